@@ -0,0 +1,5 @@
+"""
+Benchmarks of the hot paths of the blockchain: mining, verification, balances and persistence.
+
+Run them from the repository root with ``python -m benchmarks.run``.
+"""
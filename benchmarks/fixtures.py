@@ -0,0 +1,82 @@
+import json
+import os
+import random
+import tempfile
+
+from block import BLOCK_VERSION, Block
+from transaction import Transaction
+from utils import merkle
+from utils.verification import ProofChecker
+from wallet import Wallet
+
+# Keys are generated once and reused by the next runs, so the setup does not dominate the benchmarks.
+KEYS_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'blockchain-benchmark-keys.json')
+MINING_REWARD = 10
+
+
+def load_wallets(addresses, cache_path=KEYS_CACHE_PATH):
+    """
+    Returns wallets with RSA keys, generating only the keys which are not cached yet.
+    :param addresses: the number of wallets.
+    :param cache_path: the file where the generated keys are cached.
+    :return: a list of wallets.
+    """
+    try:
+        with open(cache_path, mode='r') as f:
+            keys = json.loads(f.read())
+    except (IOError, ValueError):
+        keys = []
+    wallets = []
+    for position in range(addresses):
+        wallet = Wallet('benchmark-{}'.format(position))
+        if position < len(keys):
+            wallet.public_key, wallet.private_key = keys[position]
+        else:
+            wallet.create_keys()
+            keys.append([wallet.public_key, wallet.private_key])
+        wallets.append(wallet)
+    with open(cache_path, mode='w') as f:
+        f.write(json.dumps(keys))
+    return wallets
+
+
+def generate_transactions(wallets, count, rng):
+    """
+    Generates signed transactions between random wallets.
+    :param wallets: the wallets sending and receiving the coins.
+    :param count: the number of transactions.
+    :param rng: the random generator.
+    :return: a list of transactions.
+    """
+    transactions = []
+    for _ in range(count):
+        sender, recipient = rng.sample(wallets, 2) if len(wallets) > 1 else (wallets[0], wallets[0])
+        amount = rng.randint(1, 5)
+        signature = sender.sign_transaction(sender.public_key, recipient.public_key, amount)
+        transactions.append(Transaction(sender.public_key, recipient.public_key, amount, signature))
+    return transactions
+
+
+def generate_chain(wallets, blocks, transactions_per_block, seed=0):
+    """
+    Generates a valid chain, with real proofs of work, of signed transactions between the wallets.
+    :param wallets: the wallets sending and receiving the coins.
+    :param blocks: the number of blocks after the genesis block.
+    :param transactions_per_block: the number of transactions in every block, besides the mining reward.
+    :param seed: the seed of the random generator.
+    :return: a list of blocks.
+    """
+    rng = random.Random(seed)
+    chain = [Block(0, '', [], 100, 0)]
+    for index in range(1, blocks + 1):
+        transactions = generate_transactions(wallets, transactions_per_block, rng)
+        last_hash = chain[-1].get_hash()
+        miner = rng.choice(wallets)
+        transactions.append(Transaction('MINING', miner.public_key, MINING_REWARD, ''))
+        merkle_root = merkle.compute_root(transactions)
+        checker = ProofChecker(transactions[:-1], last_hash, merkle_root=merkle_root)
+        proof = 0
+        while not checker.is_valid(proof):
+            proof += 1
+        chain.append(Block(index, last_hash, transactions, proof, float(index), BLOCK_VERSION, merkle_root))
+    return chain
@@ -0,0 +1,290 @@
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from benchmarks.fixtures import generate_chain, generate_transactions, load_wallets
+from blockchain import Blockchain
+from storage import BlockStore
+from transaction import Transaction
+from utils import hash_util, merkle, signatures, wire
+from utils.verification import ProofChecker, Verification
+from verifier import ChainVerifier
+from wallet import Wallet
+
+# Minimum number of seconds every benchmark runs.
+MIN_TIME = 0.5
+# Relative slowdown against the baseline that is reported as a regression.
+TOLERANCE = 0.25
+# Units of the results which are better when smaller, e.g. sizes. The other results are rates.
+LOWER_IS_BETTER_UNITS = ('bytes/block',)
+
+
+def measure(function, items=1, min_time=MIN_TIME):
+    """
+    Calls a function repeatedly for at least the given time.
+    :param function: the function which is measured.
+    :param items: the number of items (hashes, blocks, ...) handled by every call.
+    :param min_time: the minimum number of seconds the measurement takes.
+    :return: the number of items handled per second.
+    """
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls * items / elapsed
+
+
+def bench_proof_of_work(context):
+    block = context['chain'][-1]
+    transactions = block.transactions[:-1]
+    last_hash = context['chain'][-2].get_hash()
+    # An impossible difficulty, so the whole range of guesses is always hashed.
+    checker = ProofChecker(transactions, last_hash, difficulty=64, merkle_root=block.merkle_root)
+    guesses = 10000
+    return {
+        'proof_of_work': (measure(lambda: checker.search(0, guesses), guesses, context['min_time']), 'hashes/s'),
+        'valid_proof': (measure(lambda: Verification.valid_proof(transactions, last_hash, 0, block.merkle_root),
+                                min_time=context['min_time']), 'calls/s'),
+        'merkle_root': (measure(lambda: merkle.compute_root(block.transactions), min_time=context['min_time']),
+                        'blocks/s')
+    }
+
+
+def bench_hash_block(context):
+    block = context['chain'][-1]
+
+    def hash_uncached():
+        # Reassigning an attribute drops the cached serialization and hash.
+        block.proof = block.proof
+        hash_util.hash_block(block)
+
+    return {
+        'hash_block': (measure(hash_uncached, min_time=context['min_time']), 'blocks/s'),
+        'hash_block_cached': (measure(lambda: hash_util.hash_block(block), min_time=context['min_time']), 'blocks/s')
+    }
+
+
+def bench_verify_chain(context):
+    chain = context['chain']
+
+    def verify_uncached():
+        for block in chain:
+            block.proof = block.proof
+        Verification.verify_chain(chain)
+
+    headers = [block.get_header() for block in chain]
+    # The whole chain is spread over the verification processes, as when verifying a saved chain offline.
+    block_dicts = [block.to_dict() for block in chain]
+    verifier = ChainVerifier(threshold=0)
+    try:
+        verify_parallel = measure(lambda: verifier.verify(block_dicts), len(chain), context['min_time'])
+    finally:
+        verifier.close()
+    return {
+        'verify_chain': (measure(verify_uncached, len(chain), context['min_time']), 'blocks/s'),
+        'verify_chain_parallel': (verify_parallel, 'blocks/s'),
+        'verify_headers': (measure(lambda: Verification.verify_headers(headers), len(chain), context['min_time']),
+                           'blocks/s')
+    }
+
+
+def bench_signatures(context):
+    wallet = context['wallets'][0]
+    transactions = context['transactions']
+
+    def verify_uncached():
+        Wallet._verified_signatures.clear()
+        for transaction in transactions:
+            Wallet.verify_transaction(transaction)
+
+    ed25519_wallet = Wallet('benchmark-ed25519', signatures.ED25519_SCHEME)
+    ed25519_wallet.create_keys()
+    ed25519_transactions = [Transaction(ed25519_wallet.public_key, transaction.recipient, transaction.amount,
+                                        ed25519_wallet.sign_transaction(ed25519_wallet.public_key,
+                                                                        transaction.recipient, transaction.amount))
+                            for transaction in transactions]
+
+    def verify_ed25519_uncached():
+        Wallet._verified_signatures.clear()
+        for transaction in ed25519_transactions:
+            Wallet.verify_transaction(transaction)
+
+    return {
+        'sign_transaction': (measure(lambda: wallet.sign_transaction(wallet.public_key, 'recipient', 1),
+                                     min_time=context['min_time']), 'signatures/s'),
+        'sign_transaction_ed25519': (measure(lambda: ed25519_wallet.sign_transaction(ed25519_wallet.public_key,
+                                                                                     'recipient', 1),
+                                             min_time=context['min_time']), 'signatures/s'),
+        'verify_transaction_ed25519': (measure(verify_ed25519_uncached, len(ed25519_transactions), context['min_time']),
+                                       'verifications/s'),
+        'verify_transaction': (measure(verify_uncached, len(transactions), context['min_time']), 'verifications/s'),
+        'verify_transaction_cached': (measure(lambda: [Wallet.verify_transaction(transaction)
+                                                       for transaction in transactions],
+                                              len(transactions), context['min_time']), 'verifications/s')
+    }
+
+
+def bench_persistence(context):
+    chain = context['chain']
+    saveable_chain = [block.to_dict() for block in chain]
+    size = sum(len(json.dumps(block)) for block in saveable_chain)
+    node_ids = iter(range(sys.maxsize))
+
+    def append_blocks():
+        store = BlockStore('append-{}'.format(next(node_ids)))
+        store.load()
+        for block in saveable_chain:
+            store.append_block(block)
+        store.close()
+
+    seeded_store = BlockStore('seeded')
+    seeded_store.load()
+    seeded_store.replace_blocks(saveable_chain)
+    seeded_store.close()
+
+    def load_blockchain():
+        Blockchain(context['wallets'][0].public_key, 'seeded').close()
+
+    load_rate = measure(load_blockchain, len(chain), context['min_time'])
+    # The saves and the balance benchmark use one open blockchain, which is closed once all the benchmarks ran.
+    blockchain = Blockchain(context['wallets'][0].public_key, 'seeded')
+    context['blockchain'] = blockchain
+    save_rate = measure(blockchain.save_data, len(chain), context['min_time'])
+    append_rate = measure(append_blocks, len(chain), context['min_time'])
+    return {
+        'load_data': (load_rate, 'blocks/s'),
+        'save_data': (save_rate, 'blocks/s'),
+        'append_block': (append_rate, 'blocks/s'),
+        'append_block_bytes': (append_rate * size / len(chain), 'bytes/s')
+    }
+
+
+def bench_balance(context):
+    blockchain = context['blockchain']
+    addresses = [wallet.public_key for wallet in context['wallets']]
+    rng = random.Random(0)
+    return {
+        'get_balance': (measure(lambda: blockchain.get_balance(rng.choice(addresses)),
+                                min_time=context['min_time']), 'lookups/s')
+    }
+
+
+def bench_wire(context):
+    blocks = [block.to_dict() for block in context['chain']]
+    json_data = json.dumps(blocks)
+    wire_data = wire.encode_blocks(blocks)
+    return {
+        'json_encode_chain': (measure(lambda: json.dumps(blocks), len(blocks), context['min_time']), 'blocks/s'),
+        'json_decode_chain': (measure(lambda: json.loads(json_data), len(blocks), context['min_time']), 'blocks/s'),
+        'json_chain_size': (len(json_data.encode()) / len(blocks), 'bytes/block'),
+        'wire_encode_chain': (measure(lambda: wire.encode_blocks(blocks), len(blocks), context['min_time']),
+                              'blocks/s'),
+        'wire_decode_chain': (measure(lambda: wire.decode_blocks(wire_data), len(blocks), context['min_time']),
+                              'blocks/s'),
+        'wire_chain_size': (len(wire_data) / len(blocks), 'bytes/block')
+    }
+
+
+BENCHMARKS = [bench_proof_of_work, bench_hash_block, bench_verify_chain, bench_signatures, bench_persistence,
+              bench_balance, bench_wire]
+
+
+def run(blocks, transactions_per_block, addresses, min_time=MIN_TIME, seed=0):
+    """
+    Runs all the benchmarks on a synthetic chain.
+    :return: a dictionary with the parameters of the run and the measured results.
+    """
+    wallets = load_wallets(addresses)
+    context = {
+        'wallets': wallets,
+        'chain': generate_chain(wallets, blocks, transactions_per_block, seed),
+        'transactions': generate_transactions(wallets, 100, random.Random(seed)),
+        'min_time': min_time
+    }
+    results = {}
+    working_directory = os.getcwd()
+    data_directory = tempfile.mkdtemp(prefix='blockchain-benchmark-')
+    # The block stores are created in the current directory, which must not be the repository.
+    os.chdir(data_directory)
+    try:
+        for benchmark in BENCHMARKS:
+            for (name, value) in benchmark(context).items():
+                results[name] = {'value': value[0], 'unit': value[1],
+                                 'lower_is_better': value[1] in LOWER_IS_BETTER_UNITS}
+                print('{:<28}{:>16,.1f} {}'.format(name, value[0], value[1]))
+    finally:
+        if 'blockchain' in context:
+            context.pop('blockchain').close()
+        os.chdir(working_directory)
+        shutil.rmtree(data_directory, ignore_errors=True)
+    return {
+        'parameters': {'blocks': blocks, 'transactions_per_block': transactions_per_block, 'addresses': addresses,
+                       'min_time': min_time, 'seed': seed},
+        'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                        'cpus': os.cpu_count()},
+        'timestamp': time.time(),
+        'results': results
+    }
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """
+    Compares the results of a run against a baseline run.
+    :param report: the report of the current run.
+    :param baseline: the report of the baseline run.
+    :param tolerance: the relative slowdown, or growth of the results which are better when smaller, which is still
+    accepted.
+    :return: the names of the benchmarks which regressed.
+    """
+    regressions = []
+    for (name, result) in sorted(report['results'].items()):
+        if name not in baseline['results']:
+            continue
+        baseline_value = baseline['results'][name]['value']
+        change = result['value'] / baseline_value - 1 if baseline_value else 0
+        if result.get('lower_is_better', result['unit'] in LOWER_IS_BETTER_UNITS):
+            regressed = change > tolerance
+        else:
+            regressed = change < -tolerance
+        if regressed:
+            regressions.append(name)
+        print('{:<28}{:>+9.1%}{}'.format(name, change, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Benchmarks the hot paths of the blockchain.')
+    parser.add_argument('--blocks', type=int, default=50, help='number of blocks of the synthetic chain')
+    parser.add_argument('--transactions', type=int, default=20, help='number of transactions per block')
+    parser.add_argument('--addresses', type=int, default=8, help='number of wallets exchanging coins')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, help='minimum seconds per benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='benchmark-results.json', help='file receiving the JSON results')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='relative slowdown against the baseline reported as a regression')
+    args = parser.parse_args(argv)
+
+    report = run(args.blocks, args.transactions, args.addresses, args.min_time, args.seed)
+    with open(args.output, mode='w') as f:
+        f.write(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline, mode='r') as f:
+            baseline = json.loads(f.read())
+        print('Comparison against {}:'.format(args.baseline))
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
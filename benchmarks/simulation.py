@@ -0,0 +1,445 @@
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+from persistence import DURABILITY_GROUPED, DURABILITY_LEVELS
+from utils import signatures
+
+NODE_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'node.py')
+# Seconds between two polls of the chain summaries of the nodes.
+POLL_INTERVAL = 0.02
+# Seconds between two samples of the CPU time and memory of the node processes.
+RESOURCE_INTERVAL = 0.5
+# Seconds to wait for a node to answer after it was started, and for the nodes to agree on a chain.
+STARTUP_TIMEOUT = 30
+CONVERGENCE_TIMEOUT = 30
+# Seconds to wait for the requests sent to the nodes.
+REQUEST_TIMEOUT = 60
+# Coins sent by every generated transaction, small enough for the mining rewards to fund many of them. The signatures
+# have no nonce, so every transaction sends a slightly different amount to not be dropped as a duplicate.
+TRANSACTION_AMOUNT = 0.01
+AMOUNT_STEP = 0.000001
+# Number of threads sending the generated transactions.
+CLIENT_WORKERS = 8
+
+
+class ProcessNode:
+
+    def __init__(self, port, directory, options):
+        """
+        A node running node.py in its own process, the closest to a real deployment.
+        :param port: the port of the node.
+        :param directory: the working directory of the node, receiving its wallet and block store.
+        :param options: the parsed command line options of the simulation.
+        """
+        self.port = port
+        self.url = 'http://127.0.0.1:{}'.format(port)
+        self.__directory = directory
+        self.__options = options
+        self.__process = None
+        self.__log = None
+
+    def start(self):
+        command = [sys.executable, NODE_SCRIPT, '-p', str(self.port), '--scheme', self.__options.scheme,
+                   '--durability', self.__options.durability]
+        if self.__options.gossip_fanout is not None:
+            command += ['--gossip-fanout', str(self.__options.gossip_fanout)]
+        self.__log = open(os.path.join(self.__directory, 'node-{}.log'.format(self.port)), mode='w')
+        self.__process = subprocess.Popen(command, cwd=self.__directory, stdout=self.__log, stderr=subprocess.STDOUT)
+
+    def stop(self):
+        if self.__process is None:
+            return
+        # An interrupt lets the node commit its queued writes before it stops.
+        self.__process.send_signal(signal.SIGINT)
+        try:
+            self.__process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.__process.kill()
+            self.__process.wait()
+        self.__process = None
+        self.__log.close()
+
+    def get_resources(self):
+        """
+        Reads the CPU time and the resident memory of the node process from /proc.
+        :return: a dictionary with the CPU seconds and the resident bytes, or None if they are not available.
+        """
+        try:
+            with open('/proc/{}/stat'.format(self.__process.pid), mode='r') as f:
+                # The fields after the command name, which is in parentheses and may contain spaces.
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open('/proc/{}/status'.format(self.__process.pid), mode='r') as f:
+                rss_kilobytes = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        except (IOError, AttributeError, IndexError, StopIteration, ValueError):
+            return None
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        return {'cpu_seconds': (int(fields[11]) + int(fields[12])) / clock_ticks, 'rss_bytes': rss_kilobytes * 1024}
+
+
+class ThreadNode:
+
+    def __init__(self, port, directory, options):
+        """
+        A node served by a thread of the simulation process, which starts faster but shares the CPU time and the
+        memory of the process with the other nodes, so they can not be measured per node.
+        Every node loads its own copy of node.py, since the routes use the blockchain of their module.
+        :param port: the port of the node.
+        :param directory: the working directory of the simulation, receiving the wallets and block stores.
+        :param options: the parsed command line options of the simulation.
+        """
+        self.port = port
+        self.url = 'http://127.0.0.1:{}'.format(port)
+        self.__options = options
+        self.__module = None
+        self.__server = None
+
+    def start(self):
+        spec = importlib.util.spec_from_file_location('simulated_node_{}'.format(self.port), NODE_SCRIPT)
+        self.__module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = self.__module
+        spec.loader.exec_module(self.__module)
+        self.__module.init_node(self.port, scheme=self.__options.scheme, node_durability=self.__options.durability,
+                                fanout=self.__options.gossip_fanout)
+        # The request logs of all the nodes would be mixed with the results.
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.__server = make_server('127.0.0.1', self.port, self.__module.app, threaded=True)
+        threading.Thread(target=self.__server.serve_forever, name='node-{}'.format(self.port), daemon=True).start()
+
+    def stop(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__module.close_node()
+            self.__server = None
+
+    def get_resources(self):
+        return None
+
+
+class Simulation:
+
+    def __init__(self, options):
+        """
+        Runs a network of nodes on localhost and drives a workload through their HTTP routes.
+        :param options: the parsed command line options.
+        """
+        self.options = options
+        self.nodes = []
+        self.__rng = random.Random(options.seed)
+        self.__public_keys = []
+        # The last summary of every node as (height, tip hash).
+        self.__summaries = {}
+        # The watched blocks, by hash: their index, creation time and when each node got them.
+        self.__blocks = {}
+        self.__blocks_lock = threading.Lock()
+        self.__resources = {}
+        self.__stopped = threading.Event()
+
+    def start(self, directory):
+        node_class = ProcessNode if self.options.mode == 'process' else ThreadNode
+        self.nodes = [node_class(self.options.base_port + position, directory, self.options)
+                      for position in range(self.options.nodes)]
+        for node in self.nodes:
+            node.start()
+        deadline = time.time() + STARTUP_TIMEOUT
+        for node in self.nodes:
+            while self.__summary(node) is None:
+                if time.time() > deadline:
+                    raise RuntimeError('The node on port {} did not start!'.format(node.port))
+                time.sleep(0.1)
+        self.__public_keys = [self.__post(node, '/wallet').json()['public_key'] for node in self.nodes]
+        self.__connect_peers()
+        # Every node mines a block first, so it has coins to send.
+        for node in self.nodes:
+            self.__post(node, '/mine')
+            self.__synchronize()
+
+    def stop(self):
+        self.__stopped.set()
+        for node in self.nodes:
+            node.stop()
+
+    def run(self):
+        """
+        Sends signed transactions at a fixed rate, mines blocks at a fixed cadence and injects forks, while the
+        chain summaries and the resources of the nodes are monitored.
+        :return: the measured results.
+        """
+        options = self.options
+        monitor = threading.Thread(target=self.__monitor, name='monitor', daemon=True)
+        monitor.start()
+        start_resources = {node.port: node.get_resources() for node in self.nodes}
+        start_usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.time()
+        transactions = []
+        clients = ThreadPoolExecutor(max_workers=CLIENT_WORKERS, thread_name_prefix='client')
+        forks = []
+        miner = threading.Thread(target=self.__mine_loop, args=(start, forks), name='miner', daemon=True)
+        miner.start()
+        count = int(options.duration * options.tx_rate)
+        for number in range(count):
+            # The transactions are sent on schedule, whether the previous ones were answered or not.
+            delay = start + number / options.tx_rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            transactions.append(clients.submit(self.__send_transaction, number))
+        miner.join()
+        clients.shutdown(wait=True)
+        elapsed = time.time() - start
+        # The last transactions are confirmed by a final block.
+        self.__post(self.nodes[0], '/mine')
+        self.__synchronize()
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+        end_resources = {node.port: node.get_resources() for node in self.nodes}
+        self.__stopped.set()
+        monitor.join()
+        return self.__report(elapsed, [future.result() for future in transactions], forks,
+                             start_resources, end_resources, end_usage.ru_utime + end_usage.ru_stime
+                             - start_usage.ru_utime - start_usage.ru_stime, end_usage.ru_maxrss)
+
+    def __connect_peers(self):
+        for (position, node) in enumerate(self.nodes):
+            others = [other for other in self.nodes if other is not node]
+            if self.options.peers_per_node is None:
+                peers = others
+            else:
+                # A ring keeps the network connected, the other peers are random.
+                ring_peer = self.nodes[(position + 1) % len(self.nodes)]
+                peers = [ring_peer] + self.__rng.sample([other for other in others if other is not ring_peer],
+                                                        min(self.options.peers_per_node, len(others)) - 1)
+            for peer in peers:
+                self.__post(node, '/node', {'node': '127.0.0.1:{}'.format(peer.port)})
+
+    def __send_transaction(self, number):
+        position = self.__rng.randrange(len(self.nodes))
+        recipient = self.__rng.choice([key for (other, key) in enumerate(self.__public_keys) if other != position])
+        amount = round(TRANSACTION_AMOUNT + number * AMOUNT_STEP, 6)
+        start = time.time()
+        try:
+            response = self.__post(self.nodes[position], '/transaction', {'recipient': recipient, 'amount': amount})
+        except requests.exceptions.RequestException:
+            return None, time.time() - start
+        if response.status_code != 201:
+            return None, time.time() - start
+        return response.json()['transaction']['signature'], time.time() - start
+
+    def __mine_loop(self, start, forks):
+        options = self.options
+        fork_times = [start + options.duration * (number + 1) / (options.forks + 1) for number in range(options.forks)]
+        position = 0
+        next_block_time = start + options.block_interval
+        while True:
+            now = time.time()
+            if fork_times and fork_times[0] <= min(next_block_time, start + options.duration):
+                time.sleep(max(0.0, fork_times.pop(0) - now))
+                forks.append(self.__inject_fork())
+                continue
+            if next_block_time > start + options.duration:
+                return
+            time.sleep(max(0.0, next_block_time - now))
+            node = self.nodes[position % len(self.nodes)]
+            position += 1
+            response = self.__post(node, '/mine')
+            if response.status_code == 201:
+                self.__watch(response.json()['block'])
+            elif response.status_code == 409:
+                self.__post(node, '/resolveConflicts')
+            next_block_time += options.block_interval
+
+    def __inject_fork(self):
+        """
+        Makes two nodes mine competing blocks at the same height, then extends the chain of the first one and lets
+        every node resolve the conflict.
+        :return: the seconds until all the nodes agreed on the longer chain, or None if they did not in time.
+        """
+        if len(self.nodes) < 2:
+            return None
+        (first, second) = self.__rng.sample(self.nodes, 2)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            for future in [pool.submit(self.__post, node, '/mine') for node in (first, second)]:
+                future.result()
+        # The peers refused the competing blocks and must resolve their conflicts before they mine again.
+        self.__post(first, '/resolveConflicts')
+        response = self.__post(first, '/mine')
+        if response.status_code == 201:
+            self.__watch(response.json()['block'])
+        return self.__synchronize()
+
+    def __synchronize(self):
+        """
+        Asks the nodes to resolve their conflicts until they all have the same last block.
+        :return: the seconds it took, or None if the nodes did not agree in time.
+        """
+        start = time.time()
+        while time.time() - start < CONVERGENCE_TIMEOUT:
+            summaries = [self.__summary(node) for node in self.nodes]
+            if None not in summaries and len(set(summary['tip_hash'] for summary in summaries)) == 1:
+                return time.time() - start
+            for node in self.nodes:
+                try:
+                    self.__post(node, '/resolveConflicts')
+                except requests.exceptions.RequestException:
+                    pass
+            time.sleep(POLL_INTERVAL)
+        return None
+
+    def __watch(self, block):
+        with self.__blocks_lock:
+            self.__blocks[self.__get_block_key(block)] = {'index': block['index'], 'created': block['timestamp'],
+                                                          'reached': {}}
+
+    @staticmethod
+    def __get_block_key(block):
+        return block['index'], block['timestamp']
+
+    def __monitor(self):
+        last_resources = 0
+        while not self.__stopped.is_set():
+            now = time.time()
+            for node in self.nodes:
+                summary = self.__summary(node)
+                if summary is None:
+                    continue
+                with self.__blocks_lock:
+                    for block in self.__blocks.values():
+                        # A node which is past the block got it, unless it follows another fork.
+                        if node.port not in block['reached'] and summary['height'] > block['index']:
+                            block['reached'][node.port] = now
+            if now - last_resources >= RESOURCE_INTERVAL:
+                last_resources = now
+                for node in self.nodes:
+                    usage = node.get_resources()
+                    if usage is not None:
+                        peak = self.__resources.get(node.port, 0)
+                        self.__resources[node.port] = max(peak, usage['rss_bytes'])
+            time.sleep(POLL_INTERVAL)
+
+    def __report(self, elapsed, transactions, forks, start_resources, end_resources, process_cpu, process_maxrss):
+        confirmed_signatures = set()
+        for block in self.__get(self.nodes[0], '/chain').json():
+            confirmed_signatures.update(transaction['signature'] for transaction in block['transactions'])
+        accepted = [signature for (signature, _) in transactions if signature is not None]
+        latencies = [latency for (_, latency) in transactions]
+        propagation = [max(block['reached'].values()) - block['created'] for block in self.__blocks.values()
+                       if len(block['reached']) == len(self.nodes)]
+        nodes = []
+        for node in self.nodes:
+            before = start_resources[node.port]
+            after = end_resources[node.port]
+            nodes.append({'port': node.port,
+                          'cpu_seconds': after['cpu_seconds'] - before['cpu_seconds'] if before and after else None,
+                          'peak_rss_bytes': self.__resources.get(node.port)})
+        return {
+            'transactions': {
+                'sent': len(transactions),
+                'accepted': len(accepted),
+                'confirmed': len(confirmed_signatures.intersection(accepted)),
+                'accepted_per_second': len(accepted) / elapsed,
+                'confirmed_per_second': len(confirmed_signatures.intersection(accepted)) / elapsed,
+                'request_seconds': _summarize(latencies)
+            },
+            'blocks': {
+                'mined': len(self.__blocks),
+                'reached_all_nodes': len(propagation),
+                'propagation_seconds': _summarize(propagation)
+            },
+            'forks': {
+                'injected': len(forks),
+                'converged': sum(1 for seconds in forks if seconds is not None),
+                'convergence_seconds': _summarize([seconds for seconds in forks if seconds is not None])
+            },
+            'nodes': nodes,
+            # With the nodes in threads, only the whole simulation process can be measured.
+            'process': {'cpu_seconds': process_cpu, 'peak_rss_bytes': process_maxrss * 1024}
+        }
+
+    def __summary(self, node):
+        try:
+            response = self.__get(node, '/chain/summary')
+            return response.json() if response.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    def __get(self, node, path):
+        return requests.get(node.url + path, timeout=REQUEST_TIMEOUT)
+
+    def __post(self, node, path, payload=None):
+        return requests.post(node.url + path, json=payload, timeout=REQUEST_TIMEOUT)
+
+
+def _summarize(values):
+    """
+    Summarizes measured values.
+    :param values: the values.
+    :return: the count, mean, median, 95th percentile and maximum of the values, or None without values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return {'count': len(values), 'mean': sum(values) / len(values), 'p50': values[len(values) // 2],
+            'p95': values[min(len(values) - 1, int(len(values) * 0.95))], 'max': values[-1]}
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Simulates a network of nodes on localhost under a configurable workload.')
+    parser.add_argument('--nodes', type=int, default=4, help='number of nodes')
+    parser.add_argument('--mode', choices=('process', 'thread'), default='process',
+                        help='runs every node in its own process or in a thread of this process')
+    parser.add_argument('--peers-per-node', type=int, default=None,
+                        help='number of peers of every node (default: every node knows all the others)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds the workload runs')
+    parser.add_argument('--tx-rate', type=float, default=10.0, help='signed transactions sent per second')
+    parser.add_argument('--block-interval', type=float, default=2.0, help='seconds between two mined blocks')
+    parser.add_argument('--forks', type=int, default=1, help='number of forks injected during the workload')
+    parser.add_argument('--gossip-fanout', type=int, default=None, help='gossip fan-out of the nodes')
+    parser.add_argument('--scheme', choices=signatures.SCHEMES, default=signatures.RSA_SCHEME,
+                        help='signature scheme of the wallets')
+    parser.add_argument('--durability', choices=DURABILITY_LEVELS, default=DURABILITY_GROUPED)
+    parser.add_argument('--base-port', type=int, default=6000, help='port of the first node')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='simulation-results.json', help='file receiving the JSON results')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    working_directory = os.getcwd()
+    data_directory = tempfile.mkdtemp(prefix='blockchain-simulation-')
+    # The wallets and block stores are created in a temporary directory, which must not be the repository.
+    os.chdir(data_directory)
+    simulation = Simulation(args)
+    try:
+        simulation.start(data_directory)
+        results = simulation.run()
+    finally:
+        simulation.stop()
+        os.chdir(working_directory)
+        shutil.rmtree(data_directory, ignore_errors=True)
+    report = {
+        'parameters': vars(args),
+        'environment': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'timestamp': time.time(),
+        'results': results
+    }
+    with open(output, mode='w') as f:
+        f.write(json.dumps(report, indent=2))
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
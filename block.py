@@ -1,13 +1,127 @@
+import json
 from time import time
 
 from printable import Printable
+from transaction import Transaction
+from utils import hash_util, merkle
+
+# The original blocks, whose hash and proof of work cover the whole list of transactions.
+LEGACY_BLOCK_VERSION = 1
+# The blocks whose header commits to the transactions through their Merkle root. New blocks are mined with this
+# version, and a chain can switch from the legacy version to it only once.
+MERKLE_BLOCK_VERSION = 2
+BLOCK_VERSION = MERKLE_BLOCK_VERSION
+SUPPORTED_BLOCK_VERSIONS = (LEGACY_BLOCK_VERSION, MERKLE_BLOCK_VERSION)
 
 
 class Block(Printable):
+    # Slots instead of a __dict__ per instance, as for the transactions, keep large chains compact in memory.
+    __slots__ = ('index', 'previous_hash', 'transactions', 'proof', 'timestamp', 'version', 'merkle_root',
+                 '_canonical_bytes', '_hash')
 
-    def __init__(self, index, previous_hash, transactions, proof, timestamp=None):
+    def __init__(self, index, previous_hash, transactions, proof, timestamp=None, version=LEGACY_BLOCK_VERSION,
+                 merkle_root=None):
         self.index = index
         self.previous_hash = previous_hash
         self.transactions = transactions
         self.proof = proof
         self.timestamp = time() if timestamp is None else timestamp
+        self.version = version
+        # The Merkle root claimed by the header, which is checked against the transactions when the block is verified.
+        if merkle_root is None and version >= MERKLE_BLOCK_VERSION:
+            merkle_root = merkle.compute_root(self.transactions)
+        self.merkle_root = merkle_root
+
+    def __setattr__(self, name, value):
+        if name == 'transactions':
+            # A tuple, since a list changed in place would not invalidate the cached serialization and hash.
+            value = tuple(value)
+        # Any change of the block invalidates its cached serialization and hash.
+        if not name.startswith('_'):
+            object.__setattr__(self, '_canonical_bytes', None)
+            object.__setattr__(self, '_hash', None)
+        object.__setattr__(self, name, value)
+
+    def to_dict(self):
+        """
+        Converts the block and its transactions into plain dictionaries, e.g. to send it as JSON.
+        :return: the dictionary representation of the block.
+        """
+        block = {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'transactions': [transaction.to_dict() for transaction in self.transactions],
+            'proof': self.proof,
+            'timestamp': self.timestamp
+        }
+        if self.version != LEGACY_BLOCK_VERSION:
+            # The legacy blocks keep their original representation.
+            block['version'] = self.version
+            block['merkle_root'] = self.merkle_root
+        return block
+
+    @classmethod
+    def from_dict(cls, block):
+        """
+        Creates a block and its transactions from its dictionary representation.
+        :param block: the dictionary representation of the block.
+        :return: the new Block.
+        """
+        return cls(block['index'],
+                   block['previous_hash'],
+                   [Transaction.from_dict(transaction) for transaction in block['transactions']],
+                   block['proof'],
+                   block['timestamp'],
+                   block.get('version', LEGACY_BLOCK_VERSION),
+                   block.get('merkle_root'))
+
+    def get_header(self):
+        """
+        Returns the header of the block, which light clients use to verify the chain without the transactions.
+        The header of a legacy block does not commit to its transactions, so it carries the hash of the block instead.
+        :return: the header as a dictionary.
+        """
+        header = {
+            'version': self.version,
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'proof': self.proof,
+            'timestamp': self.timestamp
+        }
+        if self.version == LEGACY_BLOCK_VERSION:
+            header['hash'] = self.get_hash()
+        else:
+            header['merkle_root'] = self.merkle_root
+        return header
+
+    def get_canonical_bytes(self):
+        """
+        Returns the serialization of the block which is hashed, computing it only once.
+        For a legacy block it is the JSON of the block with sorted keys and without the transaction signatures,
+        written directly instead of building a dictionary of the whole block first. Later versions serialize only
+        the header, which commits to the transactions through their Merkle root.
+        :return: the serialization of the block as bytes.
+        """
+        if self._canonical_bytes is None and self.version != LEGACY_BLOCK_VERSION:
+            self._canonical_bytes = hash_util.serialize_header(self.get_header())
+        elif self._canonical_bytes is None:
+            dumps = json.dumps
+            self._canonical_bytes = b''.join([
+                b'{"index": ', dumps(self.index).encode(),
+                b', "previous_hash": ', dumps(self.previous_hash).encode(),
+                b', "proof": ', dumps(self.proof).encode(),
+                b', "timestamp": ', dumps(self.timestamp).encode(),
+                b', "transactions": [', b', '.join(transaction.get_canonical_bytes() for transaction in
+                                                  self.transactions),
+                b']}'
+            ])
+        return self._canonical_bytes
+
+    def get_hash(self):
+        """
+        Returns the hash of the block, computing it only once.
+        :return: a 256 hash representation of the block.
+        """
+        if self._hash is None:
+            self._hash = hash_util.hash_string_256(self.get_canonical_bytes())
+        return self._hash
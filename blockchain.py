@@ -1,107 +1,406 @@
-import json
-from functools import reduce
+import threading
 
 import requests
 
-from block import Block
+from block import BLOCK_VERSION, LEGACY_BLOCK_VERSION, Block
+from broadcaster import Broadcaster
+from chain import Chain
+from ledger import Ledger
+from mempool import ConfirmedSignatures, Mempool
+from miner import Miner
+from gossip import BLOCK, TRANSACTION, GossipRelay
+from peers import PeerManager
+from persistence import DURABILITY_GROUPED, PersistenceScheduler
+from storage import FSYNC_NEVER, BlockStore
 from transaction import Transaction
-from utils import hash_util
+from utils import hash_util, merkle, metrics, wire
 from utils.verification import Verification
+from verifier import ChainVerifier
 from wallet import Wallet
 
 MINING_REWARD = 10
+# Number of block hashes requested at first when looking for the fork point with a peer.
+SYNC_HASH_WINDOW = 16
+# Number of blocks added between two snapshots of the ledger.
+SNAPSHOT_INTERVAL = 100
+SNAPSHOT_VERSION = 1
+# Accept header of the block downloads: the binary wire format if the peer supports it, JSON otherwise.
+BLOCKS_ACCEPT = '{}, application/json;q=0.9'.format(wire.CONTENT_TYPE)
+
+metrics.describe('blockchain_proof_of_work_seconds', 'histogram', 'Time spent searching proofs of work.')
+metrics.describe('blockchain_proof_guesses_total', 'counter', 'Proof of work guesses hashed while mining.')
+metrics.describe('blockchain_load_seconds', 'histogram', 'Time spent loading the block store.')
+metrics.describe('blockchain_resolve_total', 'counter',
+                 'Conflict resolutions, by outcome: replaced, kept, or stale if the chain changed meanwhile.')
 
 
 class Blockchain:
 
-    def __init__(self, hosting_node_id, node_id):
-        # Starting block for the blockchain.
-        genesis_block = Block(0, '', [], 100, 0)
-        # Initializing our blockchain list.
-        self.__chain = [genesis_block]
-        # Unhandled transactions.
-        self.__open_transactions = []
+    def __init__(self, hosting_node_id, node_id, mining_workers=1, verification_workers=None,
+                 durability=DURABILITY_GROUPED, gossip_fanout=None):
+        # Unhandled transactions, indexed by their signatures.
+        self.__open_transactions = Mempool()
+        # The signatures of the transactions confirmed by the most recent blocks, which can not be confirmed again.
+        self.__confirmed_signatures = ConfirmedSignatures()
         self.hosting_node = hosting_node_id
         self.node_id = node_id
-        self.__peer_nodes = set()
+        # The peer nodes and the health of each of them.
+        self.__peers = PeerManager()
+        # Guards the chain, the open transactions and the ledger against concurrent requests and the miner.
+        self.__lock = threading.RLock()
+        # The persistence scheduler decides when the files of the store are synchronized with the disk.
+        self.__store = BlockStore(node_id, fsync=FSYNC_NEVER)
+        # Commits the writes of the store in groups, off the request threads.
+        self.__persistence = PersistenceScheduler(self.__store, durability)
+        # The blocks of the blockchain: the most recent ones in memory, the older ones read from the store.
+        self.__chain = Chain(self.__store)
+        # Sends the new transactions and blocks to the peer nodes.
+        self.__broadcaster = Broadcaster(peers=self.__peers)
+        # Chooses the peers receiving the new transactions and blocks and relays the ones received from the peers.
+        self.__gossip = GossipRelay(self.__broadcaster, gossip_fanout)
+        # Searches the proofs of work, possibly using several processes.
+        self.__miner = Miner(mining_workers)
+        # Verifies the chains downloaded from the peers, splitting long ones over several processes.
+        self.__verifier = ChainVerifier(verification_workers)
         self.resolve_conflicts = False
+        # Balances of every participant which are updated whenever the chain or the open transactions change.
+        self.__ledger = Ledger()
+        # Height of the chain when the last ledger snapshot was saved or restored.
+        self.__snapshot_height = 0
         # Loads the data of the blockchain from a save file.
         self.load_data()
+        self.__peers.start_probing(self.__probe_peer, self.__save_peers)
 
     def get_chain(self):
-        return self.__chain[:]  # Returns a copy reference of the blockchain.
+        return self.__chain.view()  # Returns a read-only view of the blockchain, which reads the blocks lazily.
 
     def get_open_transactions(self):
-        return self.__open_transactions[:]  # Returns a copy reference of the open transactions list.
+        return self.__open_transactions.get_transactions()  # Returns a copy of the open transactions list.
 
     def load_data(self):
         """
-        Loads the the blockchain and open transactions from save file.
+        Loads the the blockchain, open transactions and peer nodes from the block store.
+        The ledger is restored from the last snapshot, so only the blocks added after it are replayed.
         """
+        open_transactions = []
         try:
-            with open('blockchain-{}.txt'.format(self.node_id), mode='r') as f:
-                file_content = f.readlines()
-                blockchain = json.loads(file_content[0][:-1])
-                updated_blockchain = []
-                for block in blockchain:
-                    converted_transaction = [Transaction(tx['sender'], tx['recipient'], tx['amount'], tx['signature'])
-                                             for tx in
-                                             block['transactions']]
-                    updated_block = Block(block['index'],
-                                          block['previous_hash'],
-                                          converted_transaction,
-                                          block['proof'],
-                                          block['timestamp'])
-                    updated_blockchain.append(updated_block)
-                self.__chain = updated_blockchain
-                open_transactions = json.loads(file_content[1][:-1])
-                updated_transactions = []
-                for transaction in open_transactions:
-                    updated_transaction = Transaction(transaction['sender'], transaction['recipient'],
-                                                      transaction['amount'], transaction['signature'])
-                    updated_transactions.append(updated_transaction)
-                self.__open_transactions = updated_transactions
-
-                # Loading the peer nodes from the file.
-                peer_nodes = json.loads(file_content[2])
-                self.__peer_nodes = set(peer_nodes)
+            with metrics.timer('blockchain_load_seconds'):
+                open_transactions, peer_nodes = self.__store.load()
+            # Loading the peer nodes and their health from the store.
+            for node in peer_nodes:
+                self.__peers.add(node)
+            self.__peers.restore_health(self.__store.load_peer_health())
         except IOError:
-            print('File not found! Initializing the Blockchain with default values...')
+            print('Loading failed! Initializing the Blockchain with default values...')
+        self.__chain = Chain(self.__store)
+        if len(self.__chain) == 0:
+            print('No blocks found! Initializing the Blockchain with default values...')
+            # Starting block for the blockchain.
+            self.__persist(self.__chain.append, Block(0, '', [], 100, 0))
 
-    def save_data(self):
+        snapshot = self.__check_snapshot(self.__store.load_snapshot())
+        replayed_height = snapshot['height'] if snapshot is not None else 0
+        journal_missing = open_transactions is None and snapshot is not None
+        if journal_missing:
+            # The mempool journal is missing, so the open transactions are restored from the snapshot.
+            open_transactions = snapshot['open_transactions']
+        self.__open_transactions = Mempool(Transaction.from_dict(transaction)
+                                           for transaction in open_transactions or [])
+        # The transactions confirmed by the blocks after the snapshot are dropped, in case the node stopped before
+        # the journal was updated.
+        removed_transactions = []
+        if len(self.__open_transactions) > 0:
+            for block in self.__chain.iterate(replayed_height, len(self.__chain)):
+                removed_transactions += self.__open_transactions.remove_confirmed(block.transactions)
+        if journal_missing or removed_transactions:
+            self.__schedule(self.__store.reset_transactions,
+                            [transaction.to_dict() for transaction in self.__open_transactions])
+        self.__snapshot_height = replayed_height
+        self.__confirmed_signatures = ConfirmedSignatures()
+        first_remembered_index = max(0, len(self.__chain) - self.__confirmed_signatures.max_blocks)
+        for (index, block) in enumerate(self.__chain.iterate(first_remembered_index, len(self.__chain)),
+                                        first_remembered_index):
+            self.__confirmed_signatures.add(index, block)
+        self.__ledger.rebuild(self.__chain.iterate(replayed_height, len(self.__chain)), self.__open_transactions,
+                              snapshot['balances'] if snapshot is not None else None)
+
+    def __check_snapshot(self, snapshot):
         """
-        Saves the current state of the blockchain plus its open transactions to a file.
+        Checks that a ledger snapshot belongs to the loaded chain: the block at the height of the snapshot must have
+        the hash recorded in the snapshot, otherwise the chain was replaced or truncated after it was saved.
+        :param snapshot: the snapshot read from the store or None.
+        :return: the snapshot if it can be used or None.
         """
+        if snapshot is None:
+            return None
         try:
-            with open('blockchain-{}.txt'.format(self.node_id), mode='w') as f:
-                saveable_chain = [block.__dict__ for block in [
-                    Block(bl.index, bl.previous_hash, [tx.__dict__ for tx in bl.transactions], bl.proof, bl.timestamp)
-                    for
-                    bl in self.__chain]]
-                f.write(json.dumps(saveable_chain))
-                f.write('\n')
-                saveable_transactions = [transaction.__dict__ for transaction in self.__open_transactions]
-                f.write(json.dumps(saveable_transactions))
-                f.write('\n')
-                f.write(json.dumps(list(self.__peer_nodes)))
-        except IOError:
-            print('Saving failed!')
+            height = snapshot['height']
+            valid = snapshot['version'] == SNAPSHOT_VERSION and 0 < height <= len(self.__chain) \
+                and self.__chain[height - 1].get_hash() == snapshot['tip_hash'] \
+                and isinstance(snapshot['balances'], dict) and isinstance(snapshot['open_transactions'], list)
+        except (KeyError, TypeError):
+            valid = False
+        if not valid:
+            print('The ledger snapshot does not match the blockchain! Recalculating the ledger from all the blocks...')
+            return None
+        return snapshot
+
+    def __save_snapshot(self):
+        """ Saves the ledger and the open transactions at the current last block. """
+        with self.__lock:
+            snapshot = {
+                'version': SNAPSHOT_VERSION,
+                'height': len(self.__chain),
+                'tip_hash': self.__chain[-1].get_hash(),
+                'balances': self.__ledger.get_confirmed_balances(),
+                'open_transactions': [transaction.to_dict() for transaction in self.__open_transactions]
+            }
+            self.__schedule(self.__store.save_snapshot, snapshot)
+            self.__snapshot_height = len(self.__chain)
+
+    def __update_snapshot(self):
+        """ Saves a new ledger snapshot once enough blocks were added since the last one. """
+        if len(self.__chain) - self.__snapshot_height >= SNAPSHOT_INTERVAL:
+            self.__save_snapshot()
+
+    def save_data(self):
+        """
+        Rewrites the whole current state of the blockchain plus its open transactions and peer nodes to the store.
+        """
+        with self.__lock:
+            self.__persist(self.__chain.rewrite)
+            self.__schedule(self.__store.reset_transactions,
+                            [transaction.to_dict() for transaction in self.__open_transactions])
+            self.__save_peers()
+            self.__save_snapshot()
+        self.barrier()
+
+    def close(self):
+        """
+        Stops probing the peers, saves a ledger snapshot if blocks were added since the last one and the health of the
+        peers, commits the queued writes, closes the block store, stops the mining and verification workers and
+        closes the connections to the peers.
+        """
+        self.__peers.stop_probing()
+        if len(self.__chain) != self.__snapshot_height:
+            self.__save_snapshot()
+        self.__save_peers()
+        self.__persistence.close()
+        self.__store.close()
+        self.__miner.close()
+        self.__verifier.close()
+        self.__gossip.close()
+        self.__broadcaster.close()
+
+    def get_summary(self):
+        """
+        Summarizes the current chain for the peers synchronizing with this node.
+        :return: the height of the chain and the hash of its last block.
+        """
+        with self.__lock:
+            return {'height': len(self.__chain), 'tip_hash': self.__chain[-1].get_hash()}
+
+    def get_block_hashes(self, start, stop):
+        """
+        Returns the hashes of a range of blocks, which peers compare to find where their chains fork.
+        :param start: the index of the first block.
+        :param stop: the index where the range stops (exclusive).
+        :return: the list of block hashes.
+        """
+        return [block.get_hash() for block in self.__chain[start:stop]]
 
-    def proof_of_work(self):
+    def get_blocks(self, start, stop):
+        """
+        Returns a range of blocks, which peers download to catch up with this chain.
+        :param start: the index of the first block.
+        :param stop: the index where the range stops (exclusive).
+        :return: the list of blocks.
+        """
+        return self.__chain[start:stop]
+
+    def get_block_headers(self, start, stop):
+        """
+        Returns the headers of a range of blocks, which light clients verify without downloading the transactions.
+        :param start: the index of the first block.
+        :param stop: the index where the range stops (exclusive).
+        :return: the list of headers.
+        """
+        return [block.get_header() for block in self.__chain[start:stop]]
+
+    def get_transaction_proof(self, signature, block_index=None):
+        """
+        Finds a confirmed transaction and proves that its block includes it.
+        :param signature: the signature of the transaction.
+        :param block_index: the index of the block of the transaction, if it is known. Otherwise the blocks are
+        searched from the last one backwards.
+        :return: a dictionary with the header of the block, the transaction and its Merkle proof, or None if the
+        transaction is not in the chain.
+        """
+        if block_index is not None:
+            if not 0 <= block_index < len(self.__chain):
+                return None
+            candidate_blocks = [self.__chain[block_index]]
+        else:
+            candidate_blocks = (self.__chain[index] for index in range(len(self.__chain) - 1, -1, -1))
+        for block in candidate_blocks:
+            for (position, transaction) in enumerate(block.transactions):
+                if transaction.signature == signature:
+                    return {
+                        'block_index': block.index,
+                        'header': block.get_header(),
+                        'transaction': transaction.to_dict(),
+                        'proof': merkle.compute_proof(block.transactions, position) if block.merkle_root else None
+                    }
+        return None
+
+    def __find_fork_height(self, node, node_height):
+        """
+        Finds how many leading blocks the local chain shares with the chain of a peer.
+        The block hashes of the peer are requested in windows going backwards from the local tip,
+        doubling the window until a block which both chains share is found.
+        :param node: the peer node.
+        :param node_height: the height of the chain of the peer.
+        :return: the number of shared leading blocks.
+        :raises ValueError: when the peer returns no hashes or more than requested.
+        """
+        stop = min(len(self.__chain), node_height)
+        window = SYNC_HASH_WINDOW
+        while stop > 0:
+            start = max(0, stop - window)
+            node_hashes = self.__get_block_hashes(node, start, stop)
+            if node_hashes[0] == self.__chain[start].get_hash():
+                position = start
+                while True:
+                    for node_hash in node_hashes:
+                        if node_hash != self.__chain[position].get_hash():
+                            return position
+                        position += 1
+                    if position >= stop:
+                        return stop
+                    # The peer limits the number of hashes per page, the rest of the window is requested next.
+                    node_hashes = self.__get_block_hashes(node, position, stop)
+            stop = start
+            window *= 2
+        return 0
+
+    def __get_block_hashes(self, node, start, stop):
+        """
+        Requests a page of block hashes of a peer.
+        :param node: the peer node.
+        :param start: the index of the first block.
+        :param stop: the index where the page stops (exclusive).
+        :return: the hashes, at least one and at most the requested number.
+        :raises ValueError: when the peer returns no hashes or more than requested, so it is skipped.
+        """
+        response = self.__broadcaster.get(node, '/chain/hashes', params={'start': start, 'stop': stop})
+        node_hashes = response.json()['hashes']
+        if not isinstance(node_hashes, list) or not 0 < len(node_hashes) <= stop - start:
+            raise ValueError('The peer {} returned an invalid page of block hashes!'.format(node))
+        return node_hashes
+
+    def __download_blocks(self, node, start, stop, legacy=False):
+        """
+        Downloads the blocks of a peer, page by page.
+        :param node: the peer node.
+        :param start: the index of the first block.
+        :param stop: the index where the download stops (exclusive).
+        :param legacy: if the whole chain is downloaded from a peer without the synchronization endpoints.
+        :return: the list of downloaded blocks.
+        """
+        if legacy:
+            response = self.__broadcaster.get(node, '/chain', accept=BLOCKS_ACCEPT)
+            return [Block.from_dict(block) for block in self.__read_blocks(response)]
+        blocks = []
+        while start < stop:
+            response = self.__broadcaster.get(node, '/chain/blocks', params={'start': start, 'stop': stop},
+                                              accept=BLOCKS_ACCEPT)
+            page = [Block.from_dict(block) for block in self.__read_blocks(response, 'blocks')]
+            if len(page) == 0:
+                break
+            blocks.extend(page)
+            start += len(page)
+        return blocks
+
+    @staticmethod
+    def __read_blocks(response, key=None):
+        """
+        Reads the blocks of a response, which are in the binary wire format or in JSON depending on the peer.
+        :param response: the response of the peer.
+        :param key: the key of the list of blocks in the JSON response, if they are not the whole response.
+        :return: the blocks as plain dictionaries.
+        :raises ValueError: when the response is malformed.
+        """
+        if response.headers.get('Content-Type', '').startswith(wire.CONTENT_TYPE):
+            return wire.decode_blocks(response.content)
+        values = response.json()
+        return values[key] if key is not None else values
+
+    def __persist(self, operation, *args):
+        """
+        Runs a write operation of the block store right away, e.g. for the blocks which are read back from the store.
+        Its synchronization with the disk depends on the durability level.
+        :param operation: the chain or store method which will be called.
+        """
+        self.__persistence.run(operation, *args)
+
+    def __schedule(self, operation, *args):
+        """
+        Queues a write operation of the block store, which is committed with the next group of writes.
+        :param operation: the store method which will be called.
+        """
+        self.__persistence.submit(operation, *args)
+
+    def barrier(self, timeout=None):
+        """
+        Waits until all the previous changes are written and synchronized with the disk.
+        :param timeout: the maximum number of seconds to wait, None waits as long as needed.
+        :return: if the changes are durable.
+        """
+        return self.__persistence.barrier(timeout)
+
+    @staticmethod
+    def __common_prefix_length(chain, other_chain):
+        """
+        Counts how many leading blocks two chains share.
+        :return: the number of shared leading blocks.
+        """
+        shared_height = min(len(chain), len(other_chain))
+        for index in range(shared_height):
+            if index + 1 < shared_height:
+                # The next blocks point at the hash of the current ones, so comparing them is enough.
+                same_block = chain[index + 1].previous_hash == other_chain[index + 1].previous_hash
+            else:
+                same_block = hash_util.hash_block(chain[index]) == hash_util.hash_block(other_chain[index])
+            if not same_block:
+                return index
+        return shared_height
+
+    def proof_of_work(self, transactions=None, last_hash=None, merkle_root=None):
         """
         Generates a proof of work for the open transactions, based on the last hashed block which is guessed until it fits.
-        :return: a valid number for the proof of work.
+        :param transactions: the transactions of the mined block, the open transactions by default.
+        :param last_hash: the hash of the block the mined block extends, the last block by default.
+        :param merkle_root: the Merkle root of the mined block, if it commits to one instead of the transactions.
+        :return: a valid number for the proof of work or None if the mining was cancelled.
         """
-        last_block = self.__chain[-1]
-        last_hash = hash_util.hash_block(last_block)
-        proof = 0
-        while not Verification.valid_proof(self.__open_transactions, last_hash, proof):
-            proof += 1
+        if transactions is None:
+            transactions = self.__open_transactions.get_transactions()
+        if last_hash is None:
+            last_hash = hash_util.hash_block(self.__chain[-1])
+        with metrics.timer('blockchain_proof_of_work_seconds'):
+            proof = self.__miner.proof_of_work(transactions, last_hash, merkle_root)
+        if proof is not None:
+            # With several workers the guesses of the other nonce ranges are not counted.
+            metrics.increment('blockchain_proof_guesses_total', proof + 1)
         return proof
 
+    def cancel_mining(self):
+        """ Cancels the current proof of work search, e.g. because the last block changed. """
+        self.__miner.cancel()
+
     def get_balance(self, sender=None):
         """
-        Calculates the current balance for a participant.
+        Returns the current balance for a participant from the balance ledger.
         :return: the total balance of the participant.
         """
         if sender is None:
@@ -110,25 +409,7 @@ class Blockchain:
             participant = self.hosting_node
         else:
             participant = sender
-        # Fetches all the sent coins for the given person.
-        # This fetches the sent amounts of transactions that were already included in the blockchain.
-        tx_sender = [[tx.amount for tx in block.transactions if tx.sender == participant] for block in self.__chain]
-        # This fetches the sent amounts of open transactions (to avoid double spending).
-        open_tx_sender = [tx.amount for tx in self.__open_transactions if tx.sender == participant]
-        tx_sender.append(open_tx_sender)
-        amount_sent = reduce(lambda tx_sum, tx_amt: tx_sum + sum(tx_amt) if len(tx_amt) > 0 else tx_sum + 0, tx_sender,
-                             0)
-
-        # Fetches all the received coins for the given person.
-        # This does not consider open transactions because we can not spend the coins
-        # before the transactions was confirmed and add to the blockchain.
-        tx_recipient = [[tx.amount for tx in block.transactions if tx.recipient == participant] for block in
-                        self.__chain]
-        amount_received = reduce(lambda tx_sum, tx_amt: tx_sum + sum(tx_amt) if len(tx_amt) > 0 else tx_sum + 0,
-                                 tx_recipient, 0)
-
-        # Calculates and return the balance.
-        return amount_received - amount_sent
+        return self.__ledger.get_balance(participant)
 
     def get_last_blockchain_value(self):
         """ Returns the last value of the current blockchain. """
@@ -146,154 +427,384 @@ class Blockchain:
             return False
 
         transaction = Transaction(sender, recipient, amount, signature)
+        if not transaction.has_valid_fields():
+            return False
+
+        if transaction in self.__open_transactions \
+                or (is_receiving and self.__gossip.has_seen(TRANSACTION, signature)):
+            # The same signed transaction was already received, e.g. from another peer.
+            return True
+        if transaction in self.__confirmed_signatures:
+            # A replay of a transaction which is already in a block.
+            return False
 
         if not Wallet.verify_transaction(transaction):
             return False
 
-        if Verification.verify_transaction(transaction, self.get_balance):
-            self.__open_transactions.append(transaction)
-            self.save_data()
-            if not is_receiving:
-                for node in self.__peer_nodes:
-                    url = 'http://{}/broadcast'.format(node)
-                    try:
-                        response = requests.post(url, json={'sender': sender, 'recipient': recipient, 'amount': amount,
-                                                            'signature': signature})
-                        if response.status_code == 400 or response.status_code == 500:
-                            print('Transaction declined!')
-                            return False
-                    except requests.exceptions.ConnectionError:
-                        continue
+        with self.__lock:
+            if transaction in self.__open_transactions:
+                # Another peer relayed the same transaction meanwhile.
+                return True
+            if transaction in self.__confirmed_signatures:
+                # A block confirming the transaction was added meanwhile.
+                return False
+            accepted = Verification.verify_transaction(transaction, self.get_balance) and self.__open_transactions.add(
+                transaction)
+            if accepted:
+                self.__ledger.add_pending(transaction)
+                self.__schedule(self.__store.append_transaction, transaction.to_dict())
+        if accepted:
+            # A copy relayed by another peer meanwhile was already forwarded.
+            newly_seen = self.__gossip.mark_seen(TRANSACTION, signature)
+            if is_receiving:
+                if newly_seen:
+                    self.__gossip.relay(TRANSACTION, self.__peers.get_available_nodes(), '/broadcast',
+                                        transaction.to_dict(), encode=wire.encode_transaction)
+            else:
+                results = self.__gossip.send(self.__peers.get_available_nodes(), '/broadcast', transaction.to_dict(),
+                                             encode=wire.encode_transaction)
+                if results.declined():
+                    print('Transaction declined!')
+                    return False
             return True
         return False
 
+    def add_transactions(self, transactions, is_receiving=False):
+        """
+        Adds a batch of signed transactions with a single signature verification pass, a single write to the store
+        and a single request to every peer.
+        The balances are checked cumulatively, so a sender can not spend the same coins twice within the batch.
+        :param transactions: the transactions as dictionaries with sender, recipient, amount and signature.
+        :param is_receiving: if the batch was broadcast by a peer, in which case it is only relayed in gossip mode.
+        :return: a list with, for every transaction, if it was accepted and why, or None without a wallet.
+        """
+        if self.hosting_node is None:
+            return None
+
+        results = [None] * len(transactions)
+        converted_transactions = {}
+        for (position, transaction) in enumerate(transactions):
+            try:
+                converted_transaction = Transaction.from_dict(transaction)
+            except (KeyError, TypeError):
+                results[position] = (False, 'There are required fields missing in the transaction!')
+                continue
+            if converted_transaction.has_valid_fields():
+                converted_transactions[position] = converted_transaction
+            else:
+                results[position] = (False, 'The fields of the transaction have invalid types!')
+        signatures_valid = dict(zip(converted_transactions.keys(),
+                                    Wallet.verify_transactions(converted_transactions.values())))
+
+        accepted_transactions = []
+        # The accepted transactions which were not forwarded yet, e.g. from a copy relayed by another peer.
+        spread_transactions = []
+        try:
+            with self.__lock:
+                try:
+                    for (position, transaction) in converted_transactions.items():
+                        if transaction in self.__open_transactions \
+                                or (is_receiving and self.__gossip.has_seen(TRANSACTION, transaction.signature)):
+                            results[position] = (True, 'The transaction was already received!')
+                        elif transaction in self.__confirmed_signatures:
+                            results[position] = (False, 'The transaction was already confirmed!')
+                        elif not signatures_valid[position]:
+                            results[position] = (False, 'The signature of the transaction is invalid!')
+                        elif not Verification.verify_transaction(transaction, self.get_balance):
+                            results[position] = (False, 'The sender does not have enough funds!')
+                        else:
+                            self.__open_transactions.add(transaction)
+                            self.__ledger.add_pending(transaction)
+                            accepted_transactions.append(transaction.to_dict())
+                            if self.__gossip.mark_seen(TRANSACTION, transaction.signature) or not is_receiving:
+                                spread_transactions.append(accepted_transactions[-1])
+                            results[position] = (True, 'Successfully added a new transaction!')
+                finally:
+                    # The transactions added before an unexpected error are journaled and spread all the same.
+                    self.__schedule(self.__store.append_transactions, accepted_transactions)
+        finally:
+            self.__spread_transactions(spread_transactions, is_receiving)
+        return results
+
+    def __spread_transactions(self, transactions, is_receiving):
+        """
+        Sends a batch of added transactions to the peers, or relays it in gossip mode if it was received from a peer.
+        :param transactions: the added transactions as dictionaries.
+        :param is_receiving: if the batch was broadcast by a peer.
+        """
+        if transactions and is_receiving:
+            self.__gossip.relay(TRANSACTION, self.__peers.get_available_nodes(), '/broadcast/batch',
+                                {'transactions': transactions})
+        elif transactions:
+            peer_results = self.__gossip.send(self.__peers.get_available_nodes(), '/broadcast/batch',
+                                              {'transactions': transactions})
+            if peer_results.declined():
+                print('Transactions declined!')
+
     def mine_block(self):
-        """ Mines a new block in the blockchain. """
+        """
+        Mines a new block in the blockchain.
+        The proof is searched for the last block and the open transactions at the start of the mining. If the last
+        block changes meanwhile, e.g. because a peer block arrived, the mining is cancelled.
+        :return: the mined Block or None if it was not possible to mine it.
+        """
         if self.hosting_node is None:
             return None
 
-        last_block = self.__chain[-1]
+        with self.__lock:
+            last_block = self.__chain[-1]
+            copied_transactions = self.__open_transactions.get_transactions()  # Creates a new list with all the values.
         hashed_block = hash_util.hash_block(last_block)
 
-        proof = self.proof_of_work()
-
+        # The reward is part of the Merkle root, so it is added before the proof of work is searched.
         reward_transaction = Transaction('MINING', self.hosting_node, MINING_REWARD, '')
-        copied_transactions = self.__open_transactions[
-                              :]  # Creates a new list with all the values from the original list.
-        copied_transactions.append(reward_transaction)
-        block = Block(len(self.__chain), hashed_block, copied_transactions, proof)
+        block_transactions = copied_transactions + [reward_transaction]
+        merkle_root = merkle.compute_root(block_transactions) if BLOCK_VERSION != LEGACY_BLOCK_VERSION else None
+        proof = self.proof_of_work(copied_transactions, hashed_block, merkle_root)
+        if proof is None:
+            return None
 
-        for transaction in block.transactions:
-            if not Wallet.verify_transaction(transaction):
-                return None
+        block = Block(last_block.index + 1, hashed_block, block_transactions, proof, version=BLOCK_VERSION,
+                      merkle_root=merkle_root)
 
-        self.__chain.append(block)
-        self.__open_transactions = []
-        self.save_data()
-        for node in self.__peer_nodes:
-            url = 'http://{}/broadcastBlock'.format(node)
-            converted_block = block.__dict__.copy()
-            converted_block['transactions'] = [tx.__dict__ for tx in converted_block['transactions']]
-            try:
-                response = requests.post(url, json={'block': converted_block})
-                if response.status_code == 400 or response.status_code == 500:
-                    print('Mining declined!')
-                if response.status_code == 409:
-                    self.resolve_conflicts = True
-            except requests.exceptions.ConnectionError:
-                continue
+        if Wallet.find_invalid_transaction(block.transactions) is not None:
+            return None
+
+        with self.__lock:
+            if self.__chain[-1] is not last_block:
+                # Another block was added while mining, so this one would not fit anymore.
+                return None
+            self.__persist(self.__chain.append, block)
+            self.__confirmed_signatures.add(len(self.__chain) - 1, block)
+            # Transactions received while mining stay open for the next block.
+            removed_transactions = self.__open_transactions.remove_confirmed(block.transactions)
+            self.__ledger.confirm_block(block)
+            for open_transaction in removed_transactions:
+                self.__ledger.remove_pending(open_transaction)
+            # The journal is updated in the same group as the block, so the confirmed transactions are never loaded
+            # back as open ones.
+            self.__persist(self.__store.remove_transactions,
+                           [Mempool.get_key(open_transaction) for open_transaction in removed_transactions])
+            self.__update_snapshot()
+        self.__mark_transactions_seen([block])
+        self.__gossip.mark_seen(BLOCK, block.get_hash())
+        results = self.__gossip.send(self.__peers.get_available_nodes(), '/broadcastBlock', {'block': block.to_dict()},
+                                     encode=lambda payload: wire.encode_block(payload['block']))
+        if results.declined():
+            print('Mining declined!')
+        if results.conflicted():
+            self.resolve_conflicts = True
         return block
 
+    def has_seen_block(self, block):
+        """
+        Checks if a block broadcast by a peer was already received, e.g. relayed by another peer.
+        :param block: the block as a dictionary.
+        :return: if the block was already received.
+        """
+        try:
+            return self.__gossip.has_seen(BLOCK, Block.from_dict(block).get_hash())
+        except (KeyError, TypeError, ValueError):
+            return False
+
     def add_block(self, block):
         """
         Add an already created Block when broadcasting Blocks from different peers.
+        In gossip mode the added block is relayed to other peers.
         :param block: the Block that will be added.
         :return: if the addition was successfully.
         """
-        transactions = [
-            Transaction(
-                transaction['sender'],
-                transaction['recipient'],
-                transaction['amount'],
-                transaction['signature']) for transaction in block['transactions']
-        ]
-        proof_is_valid = Verification.valid_proof(transactions[:-1], block['previous_hash'], block['proof'])
-        hashes_match = hash_util.hash_block(self.get_chain()[-1]) == block['previous_hash']
-        if not proof_is_valid or not hashes_match:
+        converted_block = Block.from_dict(block)
+        transactions = converted_block.transactions
+        if not all(transaction.has_valid_fields() for transaction in transactions):
             return False
-        converted_block = Block(block['index'], block['previous_hash'], transactions, block['proof'],
-                                block['timestamp'])
-        self.__chain.append(converted_block)
-        stored_transactions = self.__open_transactions[:]
-        for incoming_transaction in block['transactions']:
-            for open_transaction in stored_transactions:
-                if open_transaction.sender == incoming_transaction['sender'] \
-                        and open_transaction.recipient == incoming_transaction['recipient'] \
-                        and open_transaction.amount == incoming_transaction['amount'] \
-                        and open_transaction.signature == incoming_transaction['signature']:
-                    try:
-                        self.__open_transactions.remove(open_transaction)
-                    except ValueError:
-                        print('The transaction was already removed!')
-        self.save_data()
+        if not Verification.verify_block(converted_block):
+            return False
+        if Wallet.find_invalid_transaction(transactions) is not None:
+            print('The Block contains an invalid signature!')
+            return False
+        with self.__lock:
+            if not Verification.verify_link(converted_block, self.__chain[-1]):
+                return False
+            if self.__confirmed_signatures.find_replayed([converted_block], len(self.__chain)) is not None:
+                print('The Block contains a transaction which is already confirmed!')
+                return False
+            self.__persist(self.__chain.append, converted_block)
+            self.__confirmed_signatures.add(len(self.__chain) - 1, converted_block)
+            self.__ledger.confirm_block(converted_block)
+            removed_transactions = self.__open_transactions.remove_confirmed(transactions)
+            for open_transaction in removed_transactions:
+                self.__ledger.remove_pending(open_transaction)
+            # The journal is updated in the same group as the block, so the confirmed transactions are never loaded
+            # back as open ones.
+            self.__persist(self.__store.remove_transactions,
+                           [Mempool.get_key(open_transaction) for open_transaction in removed_transactions])
+            self.__update_snapshot()
+        # The block being mined locally would extend the previous last block, so it is abandoned.
+        self.cancel_mining()
+        self.__mark_transactions_seen([converted_block])
+        if self.__gossip.mark_seen(BLOCK, converted_block.get_hash()):
+            self.__gossip.relay(BLOCK, self.__peers.get_available_nodes(), '/broadcastBlock', {'block': block},
+                                encode=lambda payload: wire.encode_block(payload['block']))
         return True
 
     def resolve(self):
         """
         Resolves the chain conflicts using a Consensus Algorithm.
+        The peers are asked for a summary of their chains first, then only the blocks after the fork point
+        of the longest valid chain are downloaded and verified.
         :return: if the chain was replaced or kept the local chain.
         """
-        winner_chain = self.get_chain()
-        replace = False
-        for node in self.__peer_nodes:
-            url = 'http://{}/chain'.format(node)
+        winner_height = len(self.__chain)
+        # The fork point with the winner chain and its blocks after it.
+        winner = None
+        summaries = []
+        # The unreachable peers are skipped until their backoff expires.
+        for node in self.__peers.get_available_nodes():
             try:
-                response = requests.get(url)
-                node_chain = response.json()
-                node_chain = [
-                    Block(
-                        block['index'],
-                        block['previous_hash'],
-                        [Transaction(
-                            transaction['sender'],
-                            transaction['recipient'],
-                            transaction['amount'],
-                            transaction['signature']) for transaction in block['transactions']],
-                        block['proof'],
-                        block['timestamp']) for block in node_chain]
-                node_chain_length = len(node_chain)
-                local_chain_length = len(winner_chain)
-                if node_chain_length > local_chain_length and Verification.verify_chain(node_chain):
-                    winner_chain = node_chain
-                    replace = True
-            except requests.exceptions.ConnectionError:
+                response = self.__broadcaster.get(node, '/chain/summary')
+                if response.status_code == 404:
+                    # The peer does not support the incremental synchronization yet.
+                    summaries.append((None, node))
+                elif response.status_code == 200:
+                    summaries.append((response.json()['height'], node))
+            except (requests.exceptions.RequestException, ValueError, KeyError):
                 continue
+        # The peers with the longest chains are tried first.
+        summaries.sort(key=lambda summary: -1 if summary[0] is None else summary[0], reverse=True)
+        for (node_height, node) in summaries:
+            if node_height is not None and node_height <= winner_height:
+                continue
+            try:
+                if node_height is None:
+                    node_chain = self.__download_blocks(node, 0, None, legacy=True)
+                    common_height = self.__common_prefix_length(self.__chain, node_chain)
+                    new_blocks = node_chain[common_height:]
+                else:
+                    common_height = self.__find_fork_height(node, node_height)
+                    new_blocks = self.__download_blocks(node, common_height, node_height)
+            except (requests.exceptions.RequestException, ValueError, KeyError):
+                continue
+            if common_height + len(new_blocks) <= winner_height:
+                continue
+            # The blocks shared with the local chain were already verified, only the new suffix is checked
+            # against the last shared block.
+            if all(transaction.has_valid_fields() for block in new_blocks for transaction in block.transactions) \
+                    and self.__confirmed_signatures.find_replayed(new_blocks, common_height) is None \
+                    and self.__verifier.verify(self.__chain[max(common_height - 1, 0):common_height] + new_blocks) \
+                    and Wallet.find_invalid_transaction([transaction for block in new_blocks
+                                                         for transaction in block.transactions]) is None:
+                winner = (common_height, new_blocks)
+                winner_height = common_height + len(new_blocks)
         self.resolve_conflicts = False
-        self.__chain = winner_chain
-        if replace:
-            self.__open_transactions = []
-        self.save_data()
+        replace = winner is not None
+        if not replace:
+            metrics.increment('blockchain_resolve_total', outcome='kept')
+        else:
+            (common_height, new_blocks) = winner
+            with self.__lock:
+                if winner_height <= len(self.__chain):
+                    # A block was added meanwhile and the local chain is as long as the winner chain.
+                    metrics.increment('blockchain_resolve_total', outcome='stale')
+                    return False
+                if common_height > 0 and self.__chain[common_height - 1].get_hash() != new_blocks[0].previous_hash:
+                    # The local chain was replaced meanwhile, so the new blocks do not follow it anymore.
+                    metrics.increment('blockchain_resolve_total', outcome='stale')
+                    return False
+                replaced_blocks = self.__chain[common_height:]
+                # The transactions of the replaced blocks and the open ones may still be valid on the new chain.
+                candidates = [transaction for block in replaced_blocks
+                              for transaction in block.transactions
+                              if transaction.sender != 'MINING'] + self.__open_transactions.get_transactions()
+                for block in reversed(replaced_blocks):
+                    self.__ledger.revert_block(block)
+                for block in new_blocks:
+                    self.__ledger.confirm_block(block)
+                self.__ledger.clear_pending()
+                self.__persist(self.__chain.replace, common_height, new_blocks)
+                self.__confirmed_signatures.remove_from(common_height)
+                for (index, block) in enumerate(new_blocks, common_height):
+                    self.__confirmed_signatures.add(index, block)
+                self.__open_transactions = Mempool()
+                self.__reinject_transactions(candidates, new_blocks)
+                self.__persist(self.__store.reset_transactions,
+                               [transaction.to_dict() for transaction in self.__open_transactions])
+                if common_height < self.__snapshot_height:
+                    # The snapshot describes a replaced block, so the next one is saved at the new last block.
+                    self.__save_snapshot()
+                else:
+                    self.__update_snapshot()
+            metrics.increment('blockchain_resolve_total', outcome='replaced')
+            # The block being mined locally would extend the replaced chain, so it is abandoned.
+            self.cancel_mining()
+            self.__mark_transactions_seen(new_blocks)
         return replace
 
+    def __mark_transactions_seen(self, blocks):
+        """
+        Remembers the transactions of added blocks as seen, so the copies still relayed by peers are neither added
+        again nor forwarded.
+        :param blocks: the added Blocks.
+        """
+        for block in blocks:
+            for signature in ConfirmedSignatures.get_signatures(block):
+                self.__gossip.mark_seen(TRANSACTION, signature)
+
+    def __reinject_transactions(self, candidates, new_blocks):
+        """
+        Puts back into the mempool the transactions which do not conflict with a new chain.
+        :param candidates: the transactions that were open or confirmed only on the replaced chain.
+        :param new_blocks: the blocks of the new chain after the fork point.
+        """
+        # The new blocks are checked too, since a long new chain may not be entirely remembered.
+        confirmed = Mempool(transaction for block in new_blocks for transaction in block.transactions)
+        for transaction in candidates:
+            if transaction in confirmed or transaction in self.__confirmed_signatures \
+                    or transaction in self.__open_transactions:
+                continue
+            # The signatures were verified before, so only the balances on the new chain are really checked.
+            if Verification.verify_transaction(transaction, self.get_balance):
+                self.__open_transactions.add(transaction)
+                self.__ledger.add_pending(transaction)
+
     def add_peer_node(self, node):
         """
         Adds a new node to the peer nodes set.
         :param node: the node URL which will be added to the set.
         """
-        self.__peer_nodes.add(node)
-        self.save_data()
+        self.__peers.add(node)
+        self.__save_peers()
 
     def remove_peer_node(self, node):
         """
         Removes a node from the peer nodes set.
         :param node: the node URL which will be removed from the set.
         """
-        self.__peer_nodes.discard(node)
-        self.save_data()
+        self.__peers.remove(node)
+        self.__save_peers()
 
     def get_peer_nodes(self):
         """
         Returns a list of all the current peer nodes in the blockchain.
         :return: a list containing all the nodes in the blockchain.
         """
-        return list(self.__peer_nodes)
+        return self.__peers.get_nodes()
+
+    def get_peer_scores(self):
+        """
+        Returns the health of every peer node: its state, score, latency, failures and when it was last seen.
+        :return: a list of dictionaries, one per peer.
+        """
+        return self.__peers.get_scores()
+
+    def __probe_peer(self, node):
+        """ Contacts a peer in the background, the broadcaster records if it answered and how fast. """
+        try:
+            self.__broadcaster.get(node, '/chain/summary')
+        except requests.exceptions.RequestException:
+            pass
+
+    def __save_peers(self):
+        """ Saves the peer nodes and their health. """
+        self.__schedule(self.__store.save_peers, self.__peers.get_nodes())
+        self.__schedule(self.__store.save_peer_health, self.__peers.to_dict())
@@ -0,0 +1,135 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from utils import metrics, wire
+
+# Maximum number of peers contacted at the same time.
+BROADCAST_WORKERS = 8
+# Seconds to wait for a peer to connect and to answer.
+BROADCAST_TIMEOUT = 5
+
+metrics.describe('broadcast_request_seconds', 'histogram', 'Latency of the requests to the peers, by peer and route.')
+metrics.describe('broadcast_failures_total', 'counter', 'Requests to the peers which failed, by peer and route.')
+
+
+class BroadcastResults(dict):
+    """ The HTTP status code answered by every peer, or None for the peers which could not be reached. """
+
+    def declined(self):
+        """ Returns if any peer refused the broadcast data. """
+        return any(status_code in (400, 500) for status_code in self.values())
+
+    def conflicted(self):
+        """ Returns if any peer reported that its chain conflicts with the local one. """
+        return any(status_code == 409 for status_code in self.values())
+
+    def unreachable(self):
+        """ Returns the peers which could not be reached. """
+        return [node for (node, status_code) in self.items() if status_code is None]
+
+
+class Broadcaster:
+
+    def __init__(self, workers=BROADCAST_WORKERS, timeout=BROADCAST_TIMEOUT, peers=None):
+        """
+        Sends requests to the peer nodes, reusing one connection per peer and contacting the peers in parallel.
+        :param workers: the maximum number of peers contacted at the same time.
+        :param timeout: the seconds to wait for a peer to connect and to answer.
+        :param peers: the PeerManager recording the latency and the failures of every request.
+        """
+        self.timeout = timeout
+        self.__peers = peers
+        self.__pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='broadcaster')
+        self.__sessions = {}
+        # Peers which answered that they do not support the binary wire format.
+        self.__json_only_nodes = set()
+        self.__lock = threading.Lock()
+
+    def post(self, nodes, path, payload, encode=None):
+        """
+        Posts the same payload to many peers in parallel.
+        :param nodes: the peer nodes.
+        :param path: the route of the peers which receives the payload.
+        :param payload: the JSON payload.
+        :param encode: the function encoding the payload in the binary wire format. The payload is encoded once and
+        sent in the wire format to the peers which support it, the other peers receive JSON.
+        :return: the BroadcastResults of all the peers.
+        """
+        nodes = list(nodes)
+        data = None
+        if encode is not None and nodes:
+            try:
+                data = encode(payload)
+            except ValueError:
+                # The payload can not be represented in the wire format, so it is sent as JSON.
+                data = None
+        status_codes = self.__pool.map(lambda node: self.__post(node, path, payload, data), nodes)
+        return BroadcastResults(zip(nodes, status_codes))
+
+    def get(self, node, path, params=None, accept=None):
+        """
+        Sends a GET request to a single peer.
+        :param node: the peer node.
+        :param path: the route of the peer.
+        :param params: the query parameters.
+        :param accept: the value of the Accept header, e.g. to prefer the binary wire format.
+        :return: the response of the peer.
+        :raises requests.exceptions.RequestException: when the peer can not be reached in time.
+        """
+        start = time.perf_counter()
+        try:
+            response = self.__session(node).get('http://{}{}'.format(node, path), params=params,
+                                                headers={'Accept': accept} if accept else None,
+                                                timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            self.__record_failure(node, path)
+            raise
+        self.__record_success(node, path, time.perf_counter() - start)
+        return response
+
+    def close(self):
+        """ Stops the broadcasting threads and closes the connections. """
+        self.__pool.shutdown(wait=False)
+        with self.__lock:
+            for session in self.__sessions.values():
+                session.close()
+            self.__sessions = {}
+
+    def __post(self, node, path, payload, data=None):
+        start = time.perf_counter()
+        url = 'http://{}{}'.format(node, path)
+        status_code = None
+        try:
+            if data is not None and node not in self.__json_only_nodes:
+                status_code = self.__session(node).post(url, data=data, headers={'Content-Type': wire.CONTENT_TYPE},
+                                                        timeout=self.timeout).status_code
+                if status_code == 415:
+                    # The peer does not know the wire format, so it receives JSON from now on.
+                    self.__json_only_nodes.add(node)
+                    status_code = None
+            if status_code is None:
+                status_code = self.__session(node).post(url, json=payload, timeout=self.timeout).status_code
+        except requests.exceptions.RequestException:
+            self.__record_failure(node, path)
+            return None
+        self.__record_success(node, path, time.perf_counter() - start)
+        return status_code
+
+    def __record_success(self, node, path, latency):
+        metrics.observe('broadcast_request_seconds', latency, peer=node, path=path)
+        if self.__peers is not None:
+            self.__peers.record_success(node, latency)
+
+    def __record_failure(self, node, path):
+        metrics.increment('broadcast_failures_total', peer=node, path=path)
+        if self.__peers is not None:
+            self.__peers.record_failure(node)
+
+    def __session(self, node):
+        with self.__lock:
+            if node not in self.__sessions:
+                self.__sessions[node] = requests.Session()
+            return self.__sessions[node]
@@ -0,0 +1,153 @@
+import threading
+
+from block import Block
+from utils.lru_cache import LRUCache
+
+# Number of most recent blocks kept in memory.
+TAIL_SIZE = 100
+# Number of older blocks kept in memory after they were read from the store, e.g. while synchronizing with a peer.
+HISTORY_CACHE_SIZE = 256
+
+
+class Chain:
+
+    def __init__(self, store, tail_size=TAIL_SIZE, history_cache_size=HISTORY_CACHE_SIZE):
+        """
+        The blocks of the blockchain, backed by the block store.
+        Only the most recent blocks are kept in memory, the older ones are read from the store when they are needed,
+        so the memory used by a node does not grow with the length of the chain.
+        :param store: the loaded BlockStore holding the blocks.
+        :param tail_size: the number of most recent blocks kept in memory.
+        :param history_cache_size: the number of older blocks kept in memory after they were read.
+        """
+        self.tail_size = tail_size
+        self.__store = store
+        # Number of leading blocks which are known to be written to the store.
+        self.__stored_height = store.get_height()
+        # The blocks starting at this index are kept in memory, the previous ones are read from the store.
+        self.__tail_start = max(self.__stored_height - 1, 0)
+        # The last block is always in memory, so it keeps its identity while blocks are mined on it.
+        self.__tail = [Block.from_dict(store.read_block(self.__tail_start))] if self.__stored_height > 0 else []
+        self.__history = LRUCache(history_cache_size)
+        self.__lock = threading.RLock()
+
+    def __len__(self):
+        return self.__tail_start + len(self.__tail)
+
+    def __getitem__(self, key):
+        with self.__lock:
+            if isinstance(key, slice):
+                return [self.__get(index) for index in range(*key.indices(len(self)))]
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError('block index out of range')
+            return self.__get(key)
+
+    def __iter__(self):
+        return self.iterate(0, len(self))
+
+    def iterate(self, start, stop):
+        """
+        Iterates over a range of blocks. The older blocks are read one at a time and are not cached, so even
+        the whole chain can be iterated without holding it in memory.
+        :param start: the index of the first block.
+        :param stop: the index where the iteration stops (exclusive).
+        """
+        for index in range(start, stop):
+            with self.__lock:
+                block = self.__get(index, cache=False)
+            yield block
+
+    def view(self):
+        """ Returns a read-only view of the blocks which are currently in the chain. """
+        return ChainView(self, len(self))
+
+    def append(self, block):
+        """
+        Appends a block to the chain and writes it to the store.
+        :param block: the Block which is appended.
+        """
+        with self.__lock:
+            self.__tail.append(block)
+            self.__write_pending_blocks()
+
+    def replace(self, common_height, blocks):
+        """
+        Replaces the blocks after a common prefix, e.g. when a longer chain of a peer wins.
+        :param common_height: the number of leading blocks which are kept.
+        :param blocks: the new blocks following the common prefix.
+        """
+        with self.__lock:
+            if common_height < self.__tail_start:
+                self.__tail = []
+                self.__tail_start = common_height
+                self.__history.clear()
+            else:
+                del self.__tail[common_height - self.__tail_start:]
+            self.__tail.extend(blocks)
+            self.__stored_height = min(self.__stored_height, common_height)
+            self.__write_pending_blocks()
+
+    def rewrite(self):
+        """ Rewrites all the blocks of the chain to the store. """
+        with self.__lock:
+            self.__store.replace_blocks([block.to_dict() for block in self])
+            self.__stored_height = len(self)
+            self.__evict()
+
+    def __get(self, index, cache=True):
+        if index >= self.__tail_start:
+            return self.__tail[index - self.__tail_start]
+        block = self.__history.get(index)
+        if block is None:
+            block = Block.from_dict(self.__store.read_block(index))
+            if cache:
+                self.__history.put(index, block)
+        return block
+
+    def __write_pending_blocks(self):
+        """
+        Writes the blocks which are not in the store yet. After a failed write the missing blocks stay in memory,
+        so they are written again with the next block.
+        """
+        if self.__store.get_height() != self.__stored_height:
+            self.__store.truncate_blocks(self.__stored_height)
+        for index in range(self.__stored_height, len(self)):
+            self.__store.append_block(self.__get(index).to_dict())
+            self.__stored_height += 1
+        self.__evict()
+
+    def __evict(self):
+        """ Drops the oldest blocks of the tail from memory, as long as they can be read from the store again. """
+        evicted = min(len(self.__tail) - self.tail_size, self.__stored_height - self.__tail_start)
+        if evicted > 0:
+            del self.__tail[:evicted]
+            self.__tail_start += evicted
+
+
+class ChainView:
+
+    def __init__(self, chain, length):
+        """
+        A read-only view of the first blocks of a Chain, which reads the blocks only when they are accessed.
+        :param chain: the Chain holding the blocks.
+        :param length: the number of blocks of the view.
+        """
+        self.__chain = chain
+        self.__length = length
+
+    def __len__(self):
+        return self.__length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.__chain[index] for index in range(*key.indices(self.__length))]
+        if key < 0:
+            key += self.__length
+        if not 0 <= key < self.__length:
+            raise IndexError('block index out of range')
+        return self.__chain[key]
+
+    def __iter__(self):
+        return self.__chain.iterate(0, self.__length)
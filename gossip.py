@@ -0,0 +1,117 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import metrics
+from utils.lru_cache import LRUCache
+
+# Number of recently seen transactions and blocks remembered to drop the copies relayed by other peers.
+SEEN_CACHE_SIZE = 100000
+# Number of threads relaying the received messages, so the sender does not wait for the next hops.
+RELAY_WORKERS = 2
+
+TRANSACTION = 'transaction'
+BLOCK = 'block'
+
+metrics.describe('gossip_duplicates_total', 'counter', 'Relayed messages which were already seen, by kind.')
+metrics.describe('gossip_relayed_total', 'counter', 'Messages relayed to a random subset of peers, by kind.')
+
+
+class GossipRelay:
+
+    def __init__(self, broadcaster, fanout=None, seen_cache_size=SEEN_CACHE_SIZE):
+        """
+        Spreads the new transactions and blocks through the network.
+        Without a fan-out, the origin sends every message to all its peers, which do not relay it. With a fan-out,
+        every node forwards each new message to that many random peers, so the messages reach all the nodes in a
+        logarithmic number of hops while every node contacts only a few peers. The copies which come back are
+        recognized by the cache of the seen messages and are not relayed again.
+        :param broadcaster: the Broadcaster sending the messages.
+        :param fanout: the number of random peers every message is forwarded to, None sends it to all the peers.
+        :param seen_cache_size: the number of seen messages which are remembered.
+        """
+        self.fanout = fanout
+        self.__broadcaster = broadcaster
+        self.__seen = LRUCache(seen_cache_size)
+        self.__seen_lock = threading.Lock()
+        self.__pool = None
+        if fanout is not None:
+            self.__pool = ThreadPoolExecutor(max_workers=RELAY_WORKERS, thread_name_prefix='gossip')
+
+    def is_relaying(self):
+        """ Returns if the received messages are forwarded to other peers. """
+        return self.fanout is not None
+
+    def has_seen(self, kind, message_id):
+        """
+        Checks if a message was already seen, counting it as a duplicate if so.
+        :param kind: TRANSACTION or BLOCK.
+        :param message_id: the signature of a transaction or the hash of a block.
+        :return: if the message was seen.
+        """
+        seen = (kind, message_id) in self.__seen
+        if seen:
+            metrics.increment('gossip_duplicates_total', kind=kind)
+        return seen
+
+    def mark_seen(self, kind, message_id):
+        """
+        Remembers a message, e.g. once it was accepted.
+        :param kind: TRANSACTION or BLOCK.
+        :param message_id: the signature of a transaction or the hash of a block.
+        :return: if the message was not seen before.
+        """
+        with self.__seen_lock:
+            if (kind, message_id) in self.__seen:
+                return False
+            self.__seen.put((kind, message_id), True)
+            return True
+
+    def select_peers(self, nodes):
+        """
+        Chooses the peers a message is sent to.
+        :param nodes: the available peer nodes.
+        :return: a random subset of fan-out peers, or all of them without a fan-out.
+        """
+        nodes = list(nodes)
+        if self.fanout is None or len(nodes) <= self.fanout:
+            return nodes
+        return random.sample(nodes, self.fanout)
+
+    def send(self, nodes, path, payload, encode=None):
+        """
+        Sends a message of this node to the selected peers and waits for their answers.
+        :param nodes: the available peer nodes.
+        :param path: the route of the peers which receives the message.
+        :param payload: the JSON payload.
+        :param encode: the function encoding the payload in the binary wire format.
+        :return: the BroadcastResults of the selected peers.
+        """
+        return self.__broadcaster.post(self.select_peers(nodes), path, payload, encode=encode)
+
+    def relay(self, kind, nodes, path, payload, encode=None):
+        """
+        Forwards a received message to the selected peers in the background, if the node relays messages.
+        :param kind: TRANSACTION or BLOCK.
+        :param nodes: the available peer nodes.
+        :param path: the route of the peers which receives the message.
+        :param payload: the JSON payload.
+        :param encode: the function encoding the payload in the binary wire format.
+        """
+        pool = self.__pool
+        if pool is None:
+            return
+        selected_nodes = self.select_peers(nodes)
+        if selected_nodes:
+            metrics.increment('gossip_relayed_total', kind=kind)
+            try:
+                pool.submit(self.__broadcaster.post, selected_nodes, path, payload, encode)
+            except RuntimeError:
+                # The relay was closed meanwhile, the node is stopping.
+                pass
+
+    def close(self):
+        """ Stops relaying messages. """
+        if self.__pool is not None:
+            self.__pool.shutdown(wait=False)
+            self.__pool = None
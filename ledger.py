@@ -0,0 +1,80 @@
+class Ledger:
+
+    def __init__(self):
+        # Net balance of every address considering only the transactions already included in the blockchain.
+        self.__confirmed = {}
+        # Amounts sent by every address in open transactions (to avoid double spending).
+        self.__pending_sent = {}
+
+    def rebuild(self, chain, open_transactions, confirmed_balances=None):
+        """
+        Recalculates the whole ledger from scratch or from the balances of a snapshot.
+        :param chain: the blocks whose transactions are already confirmed, after the snapshot if there is one.
+        :param open_transactions: the transactions which are still waiting to be mined.
+        :param confirmed_balances: the confirmed balances of a snapshot which the blocks are applied to.
+        """
+        self.__confirmed = dict(confirmed_balances) if confirmed_balances is not None else {}
+        self.__pending_sent = {}
+        for block in chain:
+            self.confirm_block(block)
+        for transaction in open_transactions:
+            self.add_pending(transaction)
+
+    def confirm_block(self, block):
+        """
+        Applies the transactions of a block that was appended to the blockchain.
+        :param block: the Block which was appended.
+        """
+        for transaction in block.transactions:
+            self.__confirmed[transaction.sender] = self.__confirmed.get(transaction.sender, 0) - transaction.amount
+            self.__confirmed[transaction.recipient] = self.__confirmed.get(transaction.recipient,
+                                                                           0) + transaction.amount
+
+    def revert_block(self, block):
+        """
+        Reverts the transactions of a block that was removed from the blockchain, e.g. by a fork resolution.
+        :param block: the Block which was removed.
+        """
+        for transaction in block.transactions:
+            self.__confirmed[transaction.sender] = self.__confirmed.get(transaction.sender, 0) + transaction.amount
+            self.__confirmed[transaction.recipient] = self.__confirmed.get(transaction.recipient,
+                                                                           0) - transaction.amount
+
+    def get_confirmed_balances(self):
+        """
+        Returns the confirmed balances of all the participants, e.g. to save them in a snapshot.
+        :return: a copy of the confirmed balances, indexed by address.
+        """
+        return dict(self.__confirmed)
+
+    def add_pending(self, transaction):
+        """
+        Reserves the amount of a new open transaction from the balance of its sender.
+        :param transaction: the open transaction.
+        """
+        self.__pending_sent[transaction.sender] = self.__pending_sent.get(transaction.sender, 0) + transaction.amount
+
+    def remove_pending(self, transaction):
+        """
+        Releases the amount of an open transaction that is no longer waiting to be mined.
+        :param transaction: the open transaction.
+        """
+        remaining = self.__pending_sent.get(transaction.sender, 0) - transaction.amount
+        if remaining > 0:
+            self.__pending_sent[transaction.sender] = remaining
+        else:
+            self.__pending_sent.pop(transaction.sender, None)
+
+    def clear_pending(self):
+        """ Releases the amounts of all the open transactions. """
+        self.__pending_sent = {}
+
+    def get_balance(self, participant):
+        """
+        Returns the balance of a participant: the confirmed coins minus the coins of its open transactions.
+        Received coins of open transactions are not considered because we can not spend them before
+        the transaction was confirmed and added to the blockchain.
+        :param participant: the address of the participant.
+        :return: the total balance of the participant.
+        """
+        return self.__confirmed.get(participant, 0) - self.__pending_sent.get(participant, 0)
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+
+# Number of most recent blocks whose transaction signatures are remembered, so their transactions are not accepted
+# and mined again.
+CONFIRMED_SIGNATURES_BLOCKS = 2000
+
+
+class Mempool:
+
+    def __init__(self, transactions=()):
+        """
+        The open transactions, indexed by their signatures and kept in insertion order.
+        :param transactions: the initial open transactions.
+        """
+        self.__transactions = OrderedDict()
+        for transaction in transactions:
+            self.add(transaction)
+
+    @staticmethod
+    def get_key(transaction):
+        """ Returns the key identifying a transaction in the mempool: its signature. """
+        return transaction.signature
+
+    def __contains__(self, transaction):
+        return self.get_key(transaction) in self.__transactions
+
+    def __len__(self):
+        return len(self.__transactions)
+
+    def __iter__(self):
+        return iter(self.__transactions.values())
+
+    def get_transactions(self):
+        """ Returns a list of the open transactions in insertion order. """
+        return list(self.__transactions.values())
+
+    def add(self, transaction):
+        """
+        Adds a transaction unless it is already in the mempool.
+        :param transaction: the open transaction.
+        :return: if the transaction was added.
+        """
+        key = self.get_key(transaction)
+        if key in self.__transactions:
+            return False
+        self.__transactions[key] = transaction
+        return True
+
+    def remove_confirmed(self, transactions):
+        """
+        Removes the transactions which were included in a block.
+        :param transactions: the transactions of the block.
+        :return: the open transactions which were removed.
+        """
+        removed = []
+        for transaction in transactions:
+            open_transaction = self.__transactions.pop(self.get_key(transaction), None)
+            if open_transaction is not None:
+                removed.append(open_transaction)
+        return removed
+
+    def clear(self):
+        """
+        Removes all the open transactions.
+        :return: the open transactions which were removed.
+        """
+        removed = self.get_transactions()
+        self.__transactions.clear()
+        return removed
+
+
+class ConfirmedSignatures:
+
+    def __init__(self, max_blocks=CONFIRMED_SIGNATURES_BLOCKS):
+        """
+        The signatures of the transactions confirmed by the most recent blocks, so a transaction which was already
+        mined, e.g. replayed after its block by a peer, is neither accepted again nor mined a second time. The
+        signatures of the oldest blocks are forgotten beyond the maximum number of blocks.
+        :param max_blocks: the number of most recent blocks which are remembered.
+        """
+        self.max_blocks = max_blocks
+        # The signatures of every remembered block, indexed by the index of the block, oldest first.
+        self.__blocks = OrderedDict()
+        # The index of the block confirming every remembered signature.
+        self.__signatures = {}
+
+    @staticmethod
+    def get_signatures(block):
+        """ Returns the signatures of the transactions of a block, without the unsigned mining reward. """
+        return [Mempool.get_key(transaction) for transaction in block.transactions if transaction.sender != 'MINING']
+
+    def __contains__(self, transaction):
+        return Mempool.get_key(transaction) in self.__signatures
+
+    def add(self, index, block):
+        """
+        Remembers the signatures of a block appended to the chain, forgetting the oldest block if needed.
+        :param index: the index of the block in the chain.
+        :param block: the Block.
+        """
+        signatures = self.get_signatures(block)
+        self.__blocks[index] = signatures
+        for signature in signatures:
+            self.__signatures[signature] = index
+        while len(self.__blocks) > self.max_blocks:
+            self.__forget(*self.__blocks.popitem(last=False))
+
+    def remove_from(self, index):
+        """
+        Forgets the signatures of the blocks from an index on, e.g. when they are replaced by a fork resolution.
+        :param index: the index of the first forgotten block.
+        """
+        for block_index in [block_index for block_index in self.__blocks if block_index >= index]:
+            self.__forget(block_index, self.__blocks.pop(block_index))
+
+    def find_replayed(self, blocks, first_index):
+        """
+        Looks for a transaction which is confirmed twice: by one of the blocks and by a remembered block before them,
+        or by two of the blocks.
+        :param blocks: the Blocks which would follow the first blocks of the chain.
+        :param first_index: the index of the first of the blocks. The remembered blocks from it on are ignored, since
+        the blocks would replace them.
+        :return: the signature of the first transaction confirmed twice or None.
+        """
+        new_signatures = set()
+        for block in blocks:
+            for signature in self.get_signatures(block):
+                if self.__signatures.get(signature, first_index) < first_index or signature in new_signatures:
+                    return signature
+                new_signatures.add(signature)
+        return None
+
+    def __forget(self, index, signatures):
+        for signature in signatures:
+            if self.__signatures.get(signature) == index:
+                del self.__signatures[signature]
@@ -0,0 +1,99 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from utils.verification import ProofChecker
+
+# Number of consecutive guesses a worker tries before checking if another worker already found a proof.
+CHUNK_SIZE = 2000
+
+# Set by the worker which finds a valid proof so the other workers stop searching.
+_proof_found = None
+
+
+def _init_worker(proof_found):
+    global _proof_found
+    _proof_found = proof_found
+
+
+def _search_proof(transactions, last_hash, merkle_root, worker_index, workers, chunk_size):
+    """
+    Searches a proof in the nonce ranges of a single worker.
+    The worker i tries the chunks i, i + workers, i + 2 * workers, ... so the workers never overlap.
+    :return: the valid proof found by this worker or None if another worker found one first.
+    """
+    checker = ProofChecker(transactions, last_hash, merkle_root=merkle_root)
+    start = worker_index * chunk_size
+    while not _proof_found.is_set():
+        proof = checker.search(start, start + chunk_size)
+        if proof is not None:
+            _proof_found.set()
+            return proof
+        start += workers * chunk_size
+    return None
+
+
+class Miner:
+
+    def __init__(self, workers=1, chunk_size=CHUNK_SIZE):
+        """
+        :param workers: the number of processes searching for a proof. None uses one per CPU core.
+        :param chunk_size: the number of guesses in every nonce range handed to a worker.
+        """
+        self.workers = max(1, workers or multiprocessing.cpu_count())
+        self.chunk_size = chunk_size
+        self.__pool = None
+        self.__proof_found = None
+        self.__cancelled = threading.Event()
+        # Only one search runs at a time, so a cancellation always targets the current one.
+        self.__search_lock = threading.Lock()
+
+    def proof_of_work(self, transactions, last_hash, merkle_root=None):
+        """
+        Searches a proof of work for the given transactions, splitting the nonces among the workers.
+        :param transactions: the transactions of the block which is being mined.
+        :param last_hash: the hash of the previous block.
+        :param merkle_root: the Merkle root of the block, if it commits to one instead of the list of transactions.
+        :return: a proof which Verification.valid_proof accepts or None if the search was cancelled.
+        """
+        with self.__search_lock:
+            self.__cancelled.clear()
+            if self.workers == 1:
+                checker = ProofChecker(transactions, last_hash, merkle_root=merkle_root)
+                start = 0
+                while not self.__cancelled.is_set():
+                    proof = checker.search(start, start + self.chunk_size)
+                    if proof is not None:
+                        return proof
+                    start += self.chunk_size
+                return None
+
+            pool = self.__get_pool()
+            self.__proof_found.clear()
+            futures = [pool.submit(_search_proof, transactions, last_hash, merkle_root, worker_index, self.workers,
+                                   self.chunk_size) for worker_index in range(self.workers)]
+            # Once a proof is found, or the search is cancelled, every worker stops after its current chunk.
+            wait(futures)
+            proofs = [proof for proof in (future.result() for future in futures) if proof is not None]
+            if self.__cancelled.is_set() or len(proofs) == 0:
+                return None
+            return min(proofs)
+
+    def cancel(self):
+        """ Cancels the current search, e.g. because the block it would extend is no longer the last one. """
+        self.__cancelled.set()
+        if self.__proof_found is not None:
+            self.__proof_found.set()
+
+    def close(self):
+        """ Stops the worker processes. """
+        if self.__pool is not None:
+            self.__pool.shutdown(cancel_futures=True)
+            self.__pool = None
+
+    def __get_pool(self):
+        if self.__pool is None:
+            self.__proof_found = multiprocessing.Event()
+            self.__pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                              initargs=(self.__proof_found,))
+        return self.__pool
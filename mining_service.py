@@ -0,0 +1,82 @@
+import threading
+import time
+
+
+class MiningService:
+
+    def __init__(self, blockchain, interval=0):
+        """
+        Mines blocks continuously in a background thread.
+        Every block is mined on the current last block and open transactions. When a peer block arrives or the
+        conflicts are resolved, the blockchain cancels the current search and the next block starts from the new tip.
+        :param blockchain: the Blockchain receiving the mined blocks.
+        :param interval: the seconds to wait after every mined block.
+        """
+        self.blockchain = blockchain
+        self.interval = interval
+        self.__thread = None
+        self.__stop_requested = threading.Event()
+        self.__started_at = None
+        self.__mined_blocks = 0
+        self.__abandoned_blocks = 0
+        self.__last_block = None
+
+    def start(self, interval=None):
+        """
+        Starts mining in the background.
+        :param interval: the seconds to wait after every mined block, the current interval by default.
+        :return: if the mining was started, i.e. it was not running yet and a wallet is set up.
+        """
+        if self.is_running() or self.blockchain.hosting_node is None:
+            return False
+        if interval is not None:
+            self.interval = interval
+        self.__stop_requested.clear()
+        self.__started_at = time.time()
+        self.__thread = threading.Thread(target=self.__run, name='mining-service', daemon=True)
+        self.__thread.start()
+        return True
+
+    def stop(self):
+        """
+        Stops mining, abandoning the block which is being mined.
+        :return: if the mining was running.
+        """
+        if not self.is_running():
+            return False
+        self.__stop_requested.set()
+        self.blockchain.cancel_mining()
+        self.__thread.join()
+        return True
+
+    def is_running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def get_status(self):
+        """
+        Returns the state of the mining.
+        :return: a dictionary with the state and the counters of the mining.
+        """
+        return {
+            'running': self.is_running(),
+            'interval': self.interval,
+            'started_at': self.__started_at,
+            'mined_blocks': self.__mined_blocks,
+            'abandoned_blocks': self.__abandoned_blocks,
+            'last_block': self.__last_block.to_dict() if self.__last_block is not None else None
+        }
+
+    def __run(self):
+        while not self.__stop_requested.is_set():
+            if self.blockchain.resolve_conflicts:
+                self.blockchain.resolve()
+            block = self.blockchain.mine_block()
+            if self.__stop_requested.is_set():
+                break
+            if block is None:
+                # The tip changed while mining, the next block is mined on the new one.
+                self.__abandoned_blocks += 1
+                continue
+            self.__mined_blocks += 1
+            self.__last_block = block
+            self.__stop_requested.wait(self.interval)
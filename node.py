@@ -1,12 +1,67 @@
-from flask import Flask, jsonify, request, send_from_directory
+import json
+import time
+
+from flask import Flask, Response, abort, g, jsonify, request, send_from_directory
 from flask_cors import CORS
 
 from blockchain import Blockchain
+from mining_service import MiningService
+from persistence import DURABILITY_GROUPED, DURABILITY_LEVELS
+from utils import metrics, signatures, wire
 from wallet import Wallet
 
+# Maximum number of block hashes and blocks returned by a single synchronization request.
+MAX_SYNC_HASHES = 2000
+MAX_SYNC_BLOCKS = 200
+MAX_SYNC_HEADERS = 2000
+
 app = Flask(__name__)
 CORS(app)
 
+metrics.describe('http_request_seconds', 'histogram', 'Latency of the requests served by the node, by route.')
+metrics.describe('blockchain_height', 'gauge', 'Number of blocks of the local chain.')
+metrics.describe('blockchain_open_transactions', 'gauge', 'Number of open transactions.')
+metrics.describe('wallet_cache_size', 'gauge', 'Entries of the signature and key caches, by cache.')
+metrics.describe('wallet_cache_hits', 'gauge', 'Hits of the signature and key caches, by cache.')
+metrics.describe('wallet_cache_misses', 'gauge', 'Misses of the signature and key caches, by cache.')
+
+
+@app.before_request
+def start_request_timer():
+    if metrics.is_enabled():
+        g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    if metrics.is_enabled() and 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule is not None else 'unknown'
+        metrics.observe('http_request_seconds', time.perf_counter() - g.request_start, route=route,
+                        method=request.method, status=response.status_code)
+    return response
+
+
+def get_request_values(decode):
+    """
+    Reads the values of a request, which peers may send in the binary wire format instead of JSON.
+    :param decode: the function decoding the wire format into the same values as the JSON.
+    :return: the values of the request or None if they are malformed.
+    """
+    if request.mimetype == wire.CONTENT_TYPE:
+        try:
+            return decode(request.get_data())
+        except wire.UnsupportedVersionError:
+            # The peer falls back to JSON when the format is not supported.
+            abort(415)
+        except ValueError:
+            return None
+    return request.get_json()
+
+
+def accepts_wire_format():
+    """ Returns if the client prefers the binary wire format over JSON, according to its Accept header. """
+    return request.accept_mimetypes.best_match(['application/json', wire.CONTENT_TYPE]) == wire.CONTENT_TYPE
+
 
 @app.route('/', methods=['GET'])
 def get_node_ui():
@@ -22,8 +77,12 @@ def get_network_ui():
 def create_keys():
     wallet.create_keys()
     if wallet.save_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+        global blockchain, mining_service
+        mining_service.stop()
+        blockchain.close()
+        blockchain = Blockchain(wallet.public_key, port, mining_workers, durability=durability,
+                                gossip_fanout=gossip_fanout)
+        mining_service = MiningService(blockchain)
         success_response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
@@ -40,8 +99,12 @@ def create_keys():
 @app.route('/wallet', methods=['GET'])
 def load_keys():
     if wallet.load_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+        global blockchain, mining_service
+        mining_service.stop()
+        blockchain.close()
+        blockchain = Blockchain(wallet.public_key, port, mining_workers, durability=durability,
+                                gossip_fanout=gossip_fanout)
+        mining_service = MiningService(blockchain)
         success_response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
@@ -74,7 +137,7 @@ def get_balance():
 
 @app.route('/broadcast', methods=['POST'])
 def broadcast_transaction():
-    values = request.get_json()
+    values = get_request_values(wire.decode_transaction)
     if not values:
         no_data_error_response = {
             'message': 'No data found to broadcast!'
@@ -106,9 +169,40 @@ def broadcast_transaction():
         return jsonify(error_response), 500
 
 
+@app.route('/broadcast/batch', methods=['POST'])
+def broadcast_transactions():
+    return add_transactions_batch(True)
+
+
+@app.route('/transactions/batch', methods=['POST'])
+def add_transactions():
+    return add_transactions_batch(False)
+
+
+def add_transactions_batch(is_receiving):
+    values = request.get_json()
+    if not values or not isinstance(values.get('transactions'), list):
+        no_data_error_response = {
+            'message': 'No list of transactions found in the request!'
+        }
+        return jsonify(no_data_error_response), 400
+    results = blockchain.add_transactions(values['transactions'], is_receiving)
+    if results is None:
+        no_wallet_error_response = {
+            'message': 'No wallet correctly setup!'
+        }
+        return jsonify(no_wallet_error_response), 400
+    response = {
+        'message': 'Accepted {} of {} transactions!'.format(sum(1 for (accepted, _) in results if accepted),
+                                                            len(results)),
+        'results': [{'accepted': accepted, 'message': message} for (accepted, message) in results]
+    }
+    return jsonify(response), 200
+
+
 @app.route('/broadcastBlock', methods=['POST'])
 def broadcast_block():
-    values = request.get_json()
+    values = get_request_values(lambda data: {'block': wire.decode_block(data)})
     if not values:
         no_data_error_response = {
             'message': 'No data found to broadcast!'
@@ -120,7 +214,13 @@ def broadcast_block():
         }
         return jsonify(required_errors_response), 400
     block = values['block']
-    if block['index'] == blockchain.get_chain()[-1].index + 1:
+    if blockchain.has_seen_block(block):
+        # Another peer relayed the same block before.
+        response = {
+            'message': 'The Block was already received!'
+        }
+        return jsonify(response), 200
+    if block['index'] == blockchain.get_last_blockchain_value().index + 1:
         if blockchain.add_block(block):
             success_response = {
                 'message': 'The Block was successfully added to the Blockchain!'
@@ -131,7 +231,7 @@ def broadcast_block():
                 'message': 'The Block was not successfully added to the Blockchain!'
             }
             return jsonify(error_response), 409
-    elif block['index'] > blockchain.get_chain()[-1].index:
+    elif block['index'] > blockchain.get_last_blockchain_value().index:
         response = {
             'message': 'The current Blockchain seems to differ from the local Blockchain. The Block was not added!'
         }
@@ -197,12 +297,11 @@ def mine_block():
 
     block = blockchain.mine_block()
     if block is not None:
-        converted_block_to_dict = block.__dict__.copy()
-        converted_block_to_dict['transactions'] = [transaction.__dict__ for transaction in
-                                                   converted_block_to_dict['transactions']]
+        # The block is reported only once it is on the disk, whatever the durability of the other writes.
+        blockchain.barrier()
         success_response = {
             'message': 'A new block was successfully mined!',
-            'block': converted_block_to_dict,
+            'block': block.to_dict(),
             'funds': blockchain.get_balance()
         }
         return jsonify(success_response), 201
@@ -214,6 +313,45 @@ def mine_block():
         return jsonify(error_response), 500
 
 
+@app.route('/mining/start', methods=['POST'])
+def start_mining():
+    values = request.get_json(silent=True) or {}
+    if blockchain.hosting_node is None:
+        no_wallet_error_response = {
+            'message': 'No wallet correctly setup!'
+        }
+        return jsonify(no_wallet_error_response), 400
+    if not mining_service.start(values.get('interval')):
+        already_running_response = {
+            'message': 'The mining is already running!',
+            'status': mining_service.get_status()
+        }
+        return jsonify(already_running_response), 409
+    success_response = {
+        'message': 'The mining was started!',
+        'status': mining_service.get_status()
+    }
+    return jsonify(success_response), 201
+
+
+@app.route('/mining/stop', methods=['POST'])
+def stop_mining():
+    if mining_service.stop():
+        message = 'The mining was stopped!'
+    else:
+        message = 'The mining was not running!'
+    response = {
+        'message': message,
+        'status': mining_service.get_status()
+    }
+    return jsonify(response), 200
+
+
+@app.route('/mining/status', methods=['GET'])
+def get_mining_status():
+    return jsonify(mining_service.get_status()), 200
+
+
 @app.route('/resolveConflicts', methods=['POST'])
 def resolve_conflicts():
     replaced = blockchain.resolve()
@@ -231,19 +369,99 @@ def resolve_conflicts():
 @app.route('/transactions', methods=['GET'])
 def get_open_transactions():
     transactions = blockchain.get_open_transactions()
-    converted_transactions_to_dict = [transaction.__dict__ for transaction in transactions]
+    converted_transactions_to_dict = [transaction.to_dict() for transaction in transactions]
     return jsonify(converted_transactions_to_dict), 200
 
 
 @app.route('/chain', methods=['GET'])
 def get_chain():
     chain_snapshot = blockchain.get_chain()
-    converted_chain_to_dict = [block.__dict__.copy() for block in chain_snapshot]
-    for converted_dict_block in converted_chain_to_dict:
-        converted_dict_block['transactions'] = [transaction.__dict__ for transaction in
-                                                converted_dict_block['transactions']]
+    if accepts_wire_format():
+        blocks = (block.to_dict() for block in chain_snapshot)
+        return Response(wire.iter_encode_blocks(blocks, len(chain_snapshot)), mimetype=wire.CONTENT_TYPE), 200
+
+    def generate_chain():
+        # The blocks are read and serialized one at a time, so the whole chain is never held in memory.
+        yield '['
+        for (position, block) in enumerate(chain_snapshot):
+            yield (',' if position > 0 else '') + json.dumps(block.to_dict())
+        yield ']'
+
     # The return of the routes is always a tuple: the body of the response and the HTTP code.
-    return jsonify(converted_chain_to_dict), 200
+    return Response(generate_chain(), mimetype='application/json'), 200
+
+
+@app.route('/chain/summary', methods=['GET'])
+def get_chain_summary():
+    return jsonify(blockchain.get_summary()), 200
+
+
+@app.route('/chain/hashes', methods=['GET'])
+def get_chain_hashes():
+    start = request.args.get('start', 0, type=int)
+    stop = request.args.get('stop', start + MAX_SYNC_HASHES, type=int)
+    response = {
+        'start': start,
+        'hashes': blockchain.get_block_hashes(start, min(stop, start + MAX_SYNC_HASHES))
+    }
+    return jsonify(response), 200
+
+
+@app.route('/chain/blocks', methods=['GET'])
+def get_chain_blocks():
+    start = request.args.get('start', 0, type=int)
+    stop = request.args.get('stop', start + MAX_SYNC_BLOCKS, type=int)
+    blocks = [block.to_dict() for block in blockchain.get_blocks(start, min(stop, start + MAX_SYNC_BLOCKS))]
+    if accepts_wire_format():
+        return Response(wire.encode_blocks(blocks), mimetype=wire.CONTENT_TYPE), 200
+    response = {
+        'start': start,
+        'blocks': blocks
+    }
+    return jsonify(response), 200
+
+
+@app.route('/chain/headers', methods=['GET'])
+def get_chain_headers():
+    start = request.args.get('start', 0, type=int)
+    stop = request.args.get('stop', start + MAX_SYNC_HEADERS, type=int)
+    response = {
+        'start': start,
+        'headers': blockchain.get_block_headers(start, min(stop, start + MAX_SYNC_HEADERS))
+    }
+    return jsonify(response), 200
+
+
+@app.route('/transaction/<signature>/proof', methods=['GET'])
+def get_transaction_proof(signature):
+    inclusion_proof = blockchain.get_transaction_proof(signature, request.args.get('block', type=int))
+    if inclusion_proof is None:
+        error_response = {
+            'message': 'The transaction was not found in the Blockchain!'
+        }
+        return jsonify(error_response), 404
+    if inclusion_proof['proof'] is None:
+        error_response = {
+            'message': 'The block of the transaction does not commit to a Merkle root!',
+            'block_index': inclusion_proof['block_index']
+        }
+        return jsonify(error_response), 400
+    return jsonify(inclusion_proof), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not metrics.is_enabled():
+        error_response = {
+            'message': 'The metrics are disabled! Start the node with --metrics to enable them.'
+        }
+        return jsonify(error_response), 404
+    metrics.set_gauge('blockchain_height', len(blockchain.get_chain()))
+    metrics.set_gauge('blockchain_open_transactions', len(blockchain.get_open_transactions()))
+    for (cache, stats) in Wallet.cache_stats().items():
+        for counter in ('size', 'hits', 'misses'):
+            metrics.set_gauge('wallet_cache_{}'.format(counter), stats[counter], cache=cache)
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 
 @app.route('/node', methods=['POST'])
@@ -287,18 +505,66 @@ def remove_node(node_url):
 def get_nodes():
     nodes = blockchain.get_peer_nodes()
     response = {
-        'all_nodes': nodes
+        'all_nodes': nodes,
+        'peers': blockchain.get_peer_scores()
     }
     return jsonify(response), 200
 
 
+def init_node(node_port, miners=1, scheme=signatures.RSA_SCHEME, node_durability=DURABILITY_GROUPED,
+              fanout=None):
+    """
+    Loads the wallet and the blockchain served by this node.
+    :param node_port: the port of the node, which also names its wallet and block store.
+    :param miners: the number of processes searching for proofs of work, 0 uses one per CPU core.
+    :param scheme: the signature scheme of the keys created for a new wallet.
+    :param node_durability: when the writes are synchronized with the disk, one of the durability levels.
+    :param fanout: the number of random peers the new transactions and blocks are relayed to, None sends them to all
+    the peers without relaying.
+    """
+    global port, mining_workers, durability, gossip_fanout, wallet, blockchain, mining_service
+    port = node_port
+    mining_workers = miners
+    durability = node_durability
+    gossip_fanout = fanout
+    wallet = Wallet(port, scheme)
+    blockchain = Blockchain(wallet.public_key, port, mining_workers, durability=durability,
+                            gossip_fanout=gossip_fanout)
+    mining_service = MiningService(blockchain)
+
+
+def close_node():
+    """ Stops the mining and closes the blockchain, committing the queued writes. """
+    mining_service.stop()
+    blockchain.close()
+
+
 if __name__ == '__main__':
     from argparse import ArgumentParser
 
     parser = ArgumentParser()
     parser.add_argument('-p', '--port', type=int, default=5000)
+    parser.add_argument('-m', '--miners', type=int, default=1,
+                        help='number of processes searching for proofs of work (0 uses one per CPU core)')
+    parser.add_argument('--scheme', choices=signatures.SCHEMES, default=signatures.RSA_SCHEME,
+                        help='signature scheme of the keys created for a new wallet (ed25519 is faster than rsa only '
+                             'with the cryptography package installed, it is about 3 times slower to verify without '
+                             'it)')
+    parser.add_argument('--durability', choices=DURABILITY_LEVELS, default=DURABILITY_GROUPED,
+                        help='when the writes are synchronized with the disk: right away, in groups committed by a '
+                             'background writer or once per second')
+    parser.add_argument('--gossip-fanout', type=int, default=None,
+                        help='relays the new transactions and blocks to this many random peers (default: the origin '
+                             'sends them to all its peers)')
+    parser.add_argument('--metrics', action='store_true', help='records metrics and exports them on /metrics')
     args = parser.parse_args()
-    port = args.port
-    wallet = Wallet(port)
-    blockchain = Blockchain(wallet.public_key, port)
-    app.run(host='0.0.0.0', port=port)
+    if args.metrics:
+        metrics.enable()
+    if args.scheme == signatures.ED25519_SCHEME and signatures.ED25519_BACKEND != 'cryptography':
+        print('The cryptography package is not installed, the Ed25519 signatures are slower than the RSA ones!')
+    init_node(args.port, args.miners, args.scheme, args.durability, args.gossip_fanout)
+    try:
+        app.run(host='0.0.0.0', port=port)
+    finally:
+        # The queued writes are committed before the node stops.
+        close_node()
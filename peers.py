@@ -0,0 +1,240 @@
+import threading
+import time
+
+from utils import metrics
+
+# Consecutive failures after which the circuit of a peer opens: it is skipped until its backoff expires.
+FAILURE_THRESHOLD = 3
+# Seconds a peer is skipped after its circuit opened, doubled with every further failure up to the maximum.
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 300.0
+# Weight of the last request in the average latency of a peer.
+LATENCY_SMOOTHING = 0.2
+# Seconds between two probes of the peers which were not heard of recently.
+PROBE_INTERVAL = 10.0
+# Seconds after which a peer which is unreachable since then is removed. None keeps the peers forever.
+DEAD_PEER_TIMEOUT = 24 * 60 * 60
+
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+UNREACHABLE = 'unreachable'
+
+metrics.describe('peers_circuit_opened_total', 'counter', 'Peers found unreachable after consecutive failures.')
+metrics.describe('peers_evicted_total', 'counter', 'Peers removed after being unreachable for too long.')
+
+
+class PeerManager:
+
+    def __init__(self, nodes=(), health=None, failure_threshold=FAILURE_THRESHOLD, backoff_base=BACKOFF_BASE,
+                 backoff_max=BACKOFF_MAX, dead_peer_timeout=DEAD_PEER_TIMEOUT):
+        """
+        The peer nodes and their health: the average latency, the consecutive failures and when they were last
+        seen. A peer failing repeatedly is skipped with an exponential backoff, so the broadcasts and the conflict
+        resolution do not wait for dead nodes, and it is removed once it is unreachable for too long.
+        :param nodes: the initial peer nodes.
+        :param health: the health of the peers saved by to_dict.
+        :param failure_threshold: the consecutive failures after which a peer is skipped.
+        :param backoff_base: the seconds a peer is skipped after its circuit opened.
+        :param backoff_max: the maximum seconds a peer is skipped.
+        :param dead_peer_timeout: the seconds after which an unreachable peer is removed, None keeps it.
+        """
+        self.failure_threshold = failure_threshold
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.dead_peer_timeout = dead_peer_timeout
+        self.__peers = {}
+        self.__lock = threading.Lock()
+        self.__probing_stopped = threading.Event()
+        self.__prober = None
+        for node in nodes:
+            self.add(node)
+        self.restore_health(health or {})
+
+    def add(self, node):
+        """
+        Adds a peer node, with a clean health if it is new.
+        :param node: the node URL.
+        """
+        with self.__lock:
+            if node not in self.__peers:
+                self.__peers[node] = {'latency': None, 'failures': 0, 'last_seen': None, 'retry_at': None,
+                                      'added': time.time()}
+
+    def remove(self, node):
+        """
+        Removes a peer node and its health.
+        :param node: the node URL.
+        """
+        with self.__lock:
+            self.__peers.pop(node, None)
+
+    def get_nodes(self):
+        """ Returns all the peer nodes, including the unreachable ones. """
+        with self.__lock:
+            return list(self.__peers)
+
+    def get_available_nodes(self):
+        """
+        Returns the peer nodes which are worth contacting: the ones whose circuit is closed and the unreachable ones
+        whose backoff expired, which get another chance.
+        :return: the nodes, the healthiest first.
+        """
+        now = time.time()
+        with self.__lock:
+            nodes = [node for (node, peer) in self.__peers.items()
+                     if peer['failures'] < self.failure_threshold or peer['retry_at'] <= now]
+            return sorted(nodes, key=lambda node: -self.__score(self.__peers[node]))
+
+    def record_success(self, node, latency):
+        """
+        Records that a peer answered, whatever its answer.
+        :param node: the node URL.
+        :param latency: the seconds the peer took to answer.
+        """
+        with self.__lock:
+            peer = self.__peers.get(node)
+            if peer is None:
+                return
+            if peer['latency'] is None:
+                peer['latency'] = latency
+            else:
+                peer['latency'] += LATENCY_SMOOTHING * (latency - peer['latency'])
+            peer['failures'] = 0
+            peer['retry_at'] = None
+            peer['last_seen'] = time.time()
+
+    def record_failure(self, node):
+        """
+        Records that a peer could not be reached in time, opening its circuit after consecutive failures.
+        :param node: the node URL.
+        """
+        with self.__lock:
+            peer = self.__peers.get(node)
+            if peer is None:
+                return
+            peer['failures'] += 1
+            if peer['failures'] >= self.failure_threshold:
+                if peer['failures'] == self.failure_threshold:
+                    metrics.increment('peers_circuit_opened_total')
+                backoff = self.backoff_base * 2 ** (peer['failures'] - self.failure_threshold)
+                peer['retry_at'] = time.time() + min(backoff, self.backoff_max)
+
+    def evict_dead_peers(self):
+        """
+        Removes the peers which are unreachable since longer than the dead peer timeout.
+        :return: the removed nodes.
+        """
+        if self.dead_peer_timeout is None:
+            return []
+        now = time.time()
+        with self.__lock:
+            dead_nodes = [node for (node, peer) in self.__peers.items()
+                          if peer['failures'] >= self.failure_threshold
+                          and now - (peer['last_seen'] or peer['added']) > self.dead_peer_timeout]
+            for node in dead_nodes:
+                del self.__peers[node]
+        for node in dead_nodes:
+            metrics.increment('peers_evicted_total')
+            print('Removed the peer {}, which is unreachable for too long.'.format(node))
+        return dead_nodes
+
+    def get_scores(self):
+        """
+        Returns the health of every peer, e.g. for the /nodes route.
+        :return: a list of dictionaries with the node, its state, its score from 0 to 100, its average latency in
+        seconds, its consecutive failures and when it was last seen and will be retried, as Unix times.
+        """
+        with self.__lock:
+            return [{'node': node,
+                     'state': self.__state(peer),
+                     'score': round(self.__score(peer), 1),
+                     'latency': peer['latency'],
+                     'failures': peer['failures'],
+                     'last_seen': peer['last_seen'],
+                     'retry_at': peer['retry_at']}
+                    for (node, peer) in sorted(self.__peers.items())]
+
+    def to_dict(self):
+        """ Returns the health of the peers as a plain dictionary, indexed by the nodes, so it can be saved. """
+        with self.__lock:
+            return {node: dict(peer) for (node, peer) in self.__peers.items()}
+
+    def start_probing(self, probe, on_change=None, interval=PROBE_INTERVAL):
+        """
+        Probes the peers in the background: the peers which were not seen during the last interval and the
+        unreachable ones whose backoff expired. The probe records its result through record_success or
+        record_failure.
+        :param probe: the function contacting a peer, called with the node URL.
+        :param on_change: the function called after every round of probes, e.g. to save the health of the peers.
+        :param interval: the seconds between two rounds of probes.
+        """
+        if self.__prober is not None:
+            return
+        self.__probing_stopped.clear()
+        self.__prober = threading.Thread(target=self.__probe_loop, args=(probe, on_change, interval),
+                                         name='peer-prober', daemon=True)
+        self.__prober.start()
+
+    def stop_probing(self):
+        """ Stops the background probes. """
+        self.__probing_stopped.set()
+        if self.__prober is not None:
+            self.__prober.join()
+            self.__prober = None
+
+    def __probe_loop(self, probe, on_change, interval):
+        while not self.__probing_stopped.wait(interval):
+            now = time.time()
+            with self.__lock:
+                nodes = [node for (node, peer) in self.__peers.items()
+                         if (peer['failures'] < self.failure_threshold
+                             and (peer['last_seen'] is None or now - peer['last_seen'] >= interval))
+                         or (peer['failures'] >= self.failure_threshold and peer['retry_at'] <= now)]
+            for node in nodes:
+                if self.__probing_stopped.is_set():
+                    return
+                probe(node)
+            evicted_nodes = self.evict_dead_peers()
+            if on_change is not None and (nodes or evicted_nodes):
+                on_change()
+
+    def restore_health(self, health):
+        """
+        Restores the saved health of the known peers.
+        :param health: the health of the peers saved by to_dict.
+        """
+        for (node, peer_health) in health.items():
+            self.__restore(node, peer_health)
+
+    def __restore(self, node, peer_health):
+        with self.__lock:
+            peer = self.__peers.get(node)
+            if peer is None:
+                # The health of a peer which was removed meanwhile.
+                return
+            try:
+                restored = {'latency': peer_health.get('latency'), 'failures': int(peer_health.get('failures', 0)),
+                            'last_seen': peer_health.get('last_seen'), 'retry_at': peer_health.get('retry_at'),
+                            'added': peer_health.get('added') or peer['added']}
+            except (AttributeError, TypeError, ValueError):
+                restored = None
+            if restored is None or not all(isinstance(restored[key], (int, float)) or restored[key] is None
+                                           for key in ('latency', 'last_seen', 'retry_at', 'added')):
+                print('Ignoring the invalid health of the peer {}.'.format(node))
+                return
+            if restored['failures'] >= self.failure_threshold and restored['retry_at'] is None:
+                restored['retry_at'] = time.time()
+            peer.update(restored)
+
+    def __state(self, peer):
+        if peer['failures'] == 0:
+            return HEALTHY
+        if peer['failures'] < self.failure_threshold:
+            return DEGRADED
+        return UNREACHABLE
+
+    def __score(self, peer):
+        # An unreachable peer scores 0, a reachable one loses points with every failure and with its latency.
+        if peer['failures'] >= self.failure_threshold:
+            return 0.0
+        return 100.0 * (1 - peer['failures'] / self.failure_threshold) / (1 + (peer['latency'] or 0))
@@ -0,0 +1,181 @@
+import threading
+import time
+
+from utils import metrics
+
+# Every write is executed and synchronized with the disk before the caller continues.
+DURABILITY_IMMEDIATE = 'immediate'
+# The writes are queued and executed by a background writer in groups, with a single synchronization per group.
+DURABILITY_GROUPED = 'grouped'
+# The writes are queued and executed by a background writer once per interval.
+DURABILITY_PERIODIC = 'periodic'
+DURABILITY_LEVELS = (DURABILITY_IMMEDIATE, DURABILITY_GROUPED, DURABILITY_PERIODIC)
+
+# Number of queued writes which are committed at once without waiting for the group window to end.
+GROUP_SIZE = 256
+# Seconds a grouped write waits for other writes to join its group.
+GROUP_WINDOW = 0.005
+# Seconds between two commits of the periodic durability.
+PERIODIC_INTERVAL = 1.0
+
+metrics.describe('blockchain_save_seconds', 'histogram', 'Time spent writing to the block store, by operation.')
+metrics.describe('persistence_group_writes', 'histogram', 'Writes committed with a single synchronization.')
+
+
+class PersistenceScheduler:
+
+    def __init__(self, store, durability=DURABILITY_GROUPED, group_size=GROUP_SIZE, group_window=GROUP_WINDOW,
+                 interval=PERIODIC_INTERVAL):
+        """
+        Takes the writes of the block store off the request threads: they are queued and committed in groups by a
+        background writer, so many transactions share a single synchronization with the disk.
+        The store must not synchronize its files by itself, the scheduler calls BlockStore.sync after every group.
+        :param store: the loaded BlockStore.
+        :param durability: one of the DURABILITY_LEVELS.
+        :param group_size: the number of queued writes which are committed without waiting for the group window.
+        :param group_window: the seconds a grouped write waits for other writes to join its group.
+        :param interval: the seconds between two commits of the periodic durability.
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError('Unknown durability level: {}'.format(durability))
+        self.durability = durability
+        self.group_size = group_size
+        self.group_window = group_window
+        self.interval = interval
+        self.__store = store
+        # Queued writes as (operation, arguments) tuples.
+        self.__pending = []
+        # Sequence number of the last submitted write and of the last one which is synchronized with the disk.
+        self.__submitted = 0
+        self.__durable = 0
+        # Time of the oldest write which is not part of a group yet.
+        self.__oldest_pending_time = None
+        self.__last_commit_time = time.monotonic()
+        self.__commit_requested = False
+        self.__closed = False
+        self.__condition = threading.Condition()
+        # Serializes the writes of the background writer with the ones run directly on the request threads.
+        self.__store_lock = threading.RLock()
+        self.__writer = None
+        if durability != DURABILITY_IMMEDIATE:
+            self.__writer = threading.Thread(target=self.__write_loop, name='persistence-writer', daemon=True)
+            self.__writer.start()
+
+    def submit(self, operation, *args):
+        """
+        Queues a write, which the background writer executes with the next group. With the immediate durability
+        it is executed and synchronized right away.
+        :param operation: the store method which will be called.
+        """
+        with self.__condition:
+            if self.__is_writing_behind():
+                self.__add_pending_write()
+                self.__pending.append((operation, args))
+                self.__condition.notify_all()
+                return
+        self.run(operation, *args)
+
+    def run(self, operation, *args):
+        """
+        Executes a write on the calling thread, e.g. the blocks, which are read back from the store right after they
+        were written. The queued writes are executed first, so the writes keep their order. It is synchronized with
+        the disk with the next group, or right away with the immediate durability.
+        :param operation: the store method which will be called.
+        """
+        with self.__store_lock:
+            with self.__condition:
+                queued_writes = self.__pending
+                self.__pending = []
+            for (queued_operation, queued_args) in queued_writes:
+                self.__execute(queued_operation, queued_args)
+            self.__execute(operation, args)
+            with self.__condition:
+                if self.__is_writing_behind():
+                    self.__add_pending_write()
+                    self.__condition.notify_all()
+                    return
+            self.__sync()
+
+    def barrier(self, timeout=None):
+        """
+        Waits until all the writes submitted or run before are executed and synchronized with the disk, e.g. so a
+        mined block is durable before it is reported.
+        :param timeout: the maximum number of seconds to wait, None waits as long as needed.
+        :return: if the writes are durable.
+        """
+        with self.__condition:
+            target = self.__submitted
+            self.__commit_requested = True
+            self.__condition.notify_all()
+            return self.__condition.wait_for(lambda: self.__durable >= target or self.__writer is None, timeout)
+
+    def close(self):
+        """ Commits the queued writes and stops the background writer. """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+            writer = self.__writer
+        if writer is not None:
+            writer.join()
+
+    def __is_writing_behind(self):
+        # The writer only stops once the scheduler is closed and nothing is left in the queue, the later writes are
+        # executed right away.
+        return self.__writer is not None
+
+    def __add_pending_write(self):
+        if self.__oldest_pending_time is None:
+            # The first write of a new group.
+            self.__oldest_pending_time = time.monotonic()
+        self.__submitted += 1
+
+    def __write_loop(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__submitted > self.__durable or self.__closed)
+                if self.__submitted == self.__durable:
+                    # Closed and nothing left to commit.
+                    self.__writer = None
+                    self.__condition.notify_all()
+                    return
+                while not self.__closed and not self.__commit_requested and len(self.__pending) < self.group_size:
+                    remaining = self.__commit_time() - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+            # The group is taken while holding the store lock, so the writes run meanwhile on the request threads
+            # can not overtake it.
+            with self.__store_lock:
+                with self.__condition:
+                    group = self.__pending
+                    target = self.__submitted
+                    self.__pending = []
+                    self.__oldest_pending_time = None
+                    self.__commit_requested = False
+                for (operation, args) in group:
+                    self.__execute(operation, args)
+                self.__sync()
+            metrics.observe('persistence_group_writes', target - self.__durable)
+            with self.__condition:
+                self.__durable = target
+                self.__last_commit_time = time.monotonic()
+                self.__condition.notify_all()
+
+    def __commit_time(self):
+        if self.durability == DURABILITY_PERIODIC:
+            return self.__last_commit_time + self.interval
+        return self.__oldest_pending_time + self.group_window
+
+    @staticmethod
+    def __execute(operation, args):
+        try:
+            with metrics.timer('blockchain_save_seconds', operation=operation.__name__):
+                operation(*args)
+        except IOError:
+            print('Saving failed!')
+
+    def __sync(self):
+        try:
+            self.__store.sync()
+        except IOError:
+            print('Saving failed!')
@@ -0,0 +1,438 @@
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+import time
+import zlib
+
+from utils import metrics
+
+# Every record is prefixed by its payload length and the CRC32 of the payload.
+RECORD_HEADER = struct.Struct('>II')
+# Maximum size of a block segment file before a new one is started.
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+metrics.describe('storage_written_bytes_total', 'counter', 'Bytes written to the block store, by file kind.')
+metrics.describe('storage_read_bytes_total', 'counter', 'Bytes read from the block store, by file kind.')
+
+# Synchronizes the files with the disk after every write.
+FSYNC_ALWAYS = 'always'
+# Synchronizes the files with the disk at most once per fsync interval.
+FSYNC_INTERVAL = 'interval'
+# Leaves the synchronization to the operating system.
+FSYNC_NEVER = 'never'
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+
+def encode_record(payload):
+    """
+    Frames a payload as a storage record.
+    :param payload: the object which will be stored as JSON.
+    :return: the bytes of the record.
+    """
+    data = json.dumps(payload).encode()
+    return RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def read_records(f, decode=True):
+    """
+    Reads all the complete and intact records from a file.
+    :param f: a binary file opened for reading.
+    :param decode: if the payloads are decoded, otherwise only their checksums are verified and the payloads are None.
+    :return: a list of (offset, length, payload) tuples plus the offset where the intact records end.
+    """
+    records = []
+    offset = 0
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            break
+        length, checksum = RECORD_HEADER.unpack(header)
+        data = f.read(length)
+        if len(data) < length or zlib.crc32(data) != checksum:
+            break
+        try:
+            payload = json.loads(data.decode()) if decode else None
+        except ValueError:
+            break
+        records.append((offset, RECORD_HEADER.size + length, payload))
+        offset += RECORD_HEADER.size + length
+    return records, offset
+
+
+class DamagedStoreError(ValueError):
+    """ Raised when a record of a block store is truncated or does not match its checksum. """
+
+    def __init__(self, segment, record, offset, blocks):
+        """
+        :param segment: the name of the segment file with the damaged record.
+        :param record: the position of the damaged record in its segment.
+        :param offset: the offset of the damaged record in its segment.
+        :param blocks: the JSON payloads of the intact blocks before the damaged record.
+        """
+        super().__init__('The record {} of {} at offset {} is damaged, {} blocks were read before it.'.format(
+            record, segment, offset, len(blocks)))
+        self.segment = segment
+        self.record = record
+        self.offset = offset
+        self.blocks = blocks
+
+
+def read_stored_blocks(directory):
+    """
+    Reads the records of all the blocks of a block store without changing it, e.g. to verify a copy of the store
+    offline. Unlike BlockStore.load, a damaged record is not recovered from.
+    :param directory: the directory of the block store.
+    :return: the JSON payloads of the blocks as bytes.
+    :raises DamagedStoreError: when a record is truncated or does not match its checksum.
+    """
+    payloads = []
+    for name in sorted(name for name in os.listdir(directory) if name.startswith('blocks-') and name.endswith('.log')):
+        with open(os.path.join(directory, name), mode='rb') as f:
+            data = f.read()
+        records, valid_size = read_records(io.BytesIO(data), decode=False)
+        payloads.extend(data[offset + RECORD_HEADER.size:offset + length] for (offset, length, _) in records)
+        if valid_size < len(data):
+            raise DamagedStoreError(name, len(records), valid_size, payloads)
+    return payloads
+
+
+class BlockStore:
+
+    def __init__(self, node_id, fsync=FSYNC_INTERVAL, fsync_interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('Unknown fsync policy: {}'.format(fsync))
+        self.node_id = node_id
+        self.directory = 'blockchain-{}'.format(node_id)
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        # Location (segment, offset, length) of every stored block, indexed by the block index.
+        self.__index = []
+        # First block index of every segment file, in order.
+        self.__segments = []
+        self.__segment_file = None
+        # Read-only memory maps of the segment files, indexed by their first block index.
+        self.__segment_maps = {}
+        self.__mempool_file = None
+        self.__last_sync = time.time()
+
+    def load(self):
+        """
+        Opens the store, recovering torn records left by a crash and migrating the legacy save file if needed.
+        Only the locations of the blocks are loaded, the blocks themselves are read with read_block.
+        :return: the open transactions and peer nodes as plain dictionaries. The open transactions are None when there
+        is no mempool journal.
+        """
+        if not os.path.isdir(self.directory):
+            self.__migrate_legacy_file()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.__load_blocks()
+        transactions = self.__load_mempool()
+        peer_nodes = self.__load_peers()
+        return transactions, peer_nodes
+
+    def close(self):
+        """ Synchronizes and closes the open files of the store. """
+        self.__close_segment_maps()
+        for f in (self.__segment_file, self.__mempool_file):
+            if f is not None and not f.closed:
+                self.__sync(f, force=True)
+                f.close()
+        self.__segment_file = None
+        self.__mempool_file = None
+
+    def sync(self):
+        """ Synchronizes the open files of the store with the disk, whatever the fsync policy. """
+        for f in (self.__segment_file, self.__mempool_file):
+            if f is not None and not f.closed:
+                self.__sync(f, force=True)
+
+    def get_height(self):
+        """ Returns the number of stored blocks. """
+        return len(self.__index)
+
+    def read_block(self, index):
+        """
+        Reads a stored block through the memory map of its segment.
+        :param index: the index of the block.
+        :return: the block as a plain dictionary.
+        """
+        segment, offset, length = self.__index[index]
+        segment_map = self.__segment_maps.get(segment)
+        if segment_map is None or len(segment_map) < offset + length:
+            # The segment was not mapped yet or it grew since it was mapped.
+            if self.__segment_file is not None and segment == self.__segments[-1]:
+                self.__segment_file.flush()
+            if segment_map is not None:
+                segment_map.close()
+            with open(self.__segment_path(segment), mode='rb') as f:
+                segment_map = self.__segment_maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = segment_map[offset + RECORD_HEADER.size:offset + length]
+        metrics.increment('storage_read_bytes_total', len(data), kind='blocks')
+        return json.loads(data.decode())
+
+    def append_block(self, block):
+        """
+        Appends a single block record to the active segment.
+        :param block: the block as a plain dictionary.
+        """
+        record = encode_record(block)
+        f = self.__active_segment(len(record))
+        offset = f.tell()
+        f.write(record)
+        self.__sync(f)
+        metrics.increment('storage_written_bytes_total', len(record), kind='blocks')
+        self.__index.append((self.__segments[-1], offset, len(record)))
+
+    def truncate_blocks(self, height):
+        """
+        Removes all the blocks starting at a given index, e.g. when a longer chain replaces the local one.
+        :param height: the number of blocks which will be kept.
+        """
+        if height >= len(self.__index):
+            return
+        # A mapped file must not be truncated.
+        self.__close_segment_maps()
+        if self.__segment_file is not None:
+            self.__segment_file.close()
+            self.__segment_file = None
+        segment, offset, _ = self.__index[height]
+        for first_index in [s for s in self.__segments if s > segment]:
+            os.remove(self.__segment_path(first_index))
+        self.__segments = [s for s in self.__segments if s <= segment]
+        if offset == 0 and len(self.__segments) > 1:
+            os.remove(self.__segment_path(segment))
+            self.__segments.pop()
+        else:
+            with open(self.__segment_path(segment), mode='r+b') as f:
+                f.truncate(offset)
+                self.__sync(f, force=True)
+        del self.__index[height:]
+
+    def replace_blocks(self, blocks, common_height=0):
+        """
+        Replaces the stored blocks after a common prefix with new ones.
+        :param blocks: the blocks following the common prefix as plain dictionaries, the whole chain by default.
+        :param common_height: the number of leading blocks that the stored and the new chain share.
+        """
+        self.truncate_blocks(common_height)
+        for block in blocks:
+            self.append_block(block)
+
+    def append_transaction(self, transaction):
+        """
+        Journals a new open transaction.
+        :param transaction: the transaction as a plain dictionary.
+        """
+        self.__write_mempool_records([{'op': 'add', 'transaction': transaction}])
+
+    def append_transactions(self, transactions):
+        """
+        Journals many new open transactions with a single write.
+        :param transactions: the transactions as plain dictionaries.
+        """
+        if transactions:
+            self.__write_mempool_records([{'op': 'add', 'transaction': transaction} for transaction in transactions])
+
+    def remove_transactions(self, signatures):
+        """
+        Journals the removal of open transactions, e.g. after they were included in a block.
+        :param signatures: the signatures of the removed transactions.
+        """
+        if signatures:
+            self.__write_mempool_records([{'op': 'remove', 'signatures': list(signatures)}])
+
+    def reset_transactions(self, transactions):
+        """
+        Rewrites the journal so it contains only the given open transactions.
+        :param transactions: the open transactions as plain dictionaries.
+        """
+        if self.__mempool_file is not None:
+            self.__mempool_file.close()
+            self.__mempool_file = None
+        self.__write_atomically(self.__mempool_path(),
+                                b''.join(encode_record({'op': 'add', 'transaction': tx}) for tx in transactions))
+
+    def save_snapshot(self, snapshot):
+        """
+        Saves a checkpoint of the ledger state, replacing the previous one atomically.
+        :param snapshot: the checkpoint as a plain dictionary.
+        """
+        self.__write_atomically(self.__snapshot_path(), encode_record(snapshot))
+
+    def load_snapshot(self):
+        """
+        Reads the last checkpoint of the ledger state.
+        :return: the checkpoint as a plain dictionary or None if there is no intact one.
+        """
+        try:
+            with open(self.__snapshot_path(), mode='rb') as f:
+                records, _ = read_records(f)
+                metrics.increment('storage_read_bytes_total', f.tell(), kind='snapshot')
+        except IOError:
+            return None
+        return records[0][2] if records else None
+
+    def save_peers(self, peer_nodes):
+        """
+        Saves the peer nodes, replacing the previous file atomically.
+        :param peer_nodes: the list of peer nodes.
+        """
+        self.__write_atomically(os.path.join(self.directory, 'peers.json'), json.dumps(peer_nodes).encode())
+
+    def save_peer_health(self, health):
+        """
+        Saves the health of the peer nodes next to the peer list, replacing the previous file atomically.
+        :param health: the health of the peers as a plain dictionary, indexed by the nodes.
+        """
+        self.__write_atomically(os.path.join(self.directory, 'peer-health.json'), json.dumps(health).encode())
+
+    def load_peer_health(self):
+        """
+        Reads the saved health of the peer nodes.
+        :return: the health of the peers as a plain dictionary, empty if it was never saved or is unreadable.
+        """
+        try:
+            with open(os.path.join(self.directory, 'peer-health.json'), mode='r') as f:
+                health = json.loads(f.read())
+        except (IOError, ValueError):
+            return {}
+        return health if isinstance(health, dict) else {}
+
+    def __segment_path(self, first_index):
+        return os.path.join(self.directory, 'blocks-{:010d}.log'.format(first_index))
+
+    def __mempool_path(self):
+        return os.path.join(self.directory, 'mempool.log')
+
+    def __snapshot_path(self):
+        return os.path.join(self.directory, 'snapshot.dat')
+
+    def __active_segment(self, record_size):
+        if self.__segment_file is not None and self.__segment_file.tell() + record_size > SEGMENT_SIZE \
+                and self.__segment_file.tell() > 0:
+            self.__sync(self.__segment_file, force=True)
+            self.__segment_file.close()
+            self.__segment_file = None
+            self.__segments.append(len(self.__index))
+        if not self.__segments:
+            self.__segments.append(0)
+        if self.__segment_file is None:
+            self.__segment_file = open(self.__segment_path(self.__segments[-1]), mode='ab')
+        return self.__segment_file
+
+    def __close_segment_maps(self):
+        for segment_map in self.__segment_maps.values():
+            segment_map.close()
+        self.__segment_maps = {}
+
+    def __sync(self, f, force=False):
+        f.flush()
+        if self.fsync == FSYNC_NEVER and not force:
+            return
+        if self.fsync == FSYNC_INTERVAL and not force and time.time() - self.__last_sync < self.fsync_interval:
+            return
+        os.fsync(f.fileno())
+        self.__last_sync = time.time()
+
+    def __write_atomically(self, path, data):
+        temporary_path = path + '.tmp'
+        with open(temporary_path, mode='wb') as f:
+            f.write(data)
+            self.__sync(f, force=True)
+        os.replace(temporary_path, path)
+        metrics.increment('storage_written_bytes_total', len(data), kind=os.path.basename(path).split('.')[0])
+
+    def __write_mempool_records(self, records):
+        if self.__mempool_file is None:
+            self.__mempool_file = open(self.__mempool_path(), mode='ab')
+        data = b''.join(encode_record(record) for record in records)
+        self.__mempool_file.write(data)
+        self.__sync(self.__mempool_file)
+        metrics.increment('storage_written_bytes_total', len(data), kind='mempool')
+
+    def __load_blocks(self):
+        self.__segments = sorted(int(name[7:17]) for name in os.listdir(self.directory)
+                                 if name.startswith('blocks-') and name.endswith('.log'))
+        self.__index = []
+        self.__close_segment_maps()
+        for position, first_index in enumerate(self.__segments):
+            path = self.__segment_path(first_index)
+            with open(path, mode='rb') as f:
+                records, valid_size = read_records(f, decode=False)
+                size = f.seek(0, os.SEEK_END)
+            metrics.increment('storage_read_bytes_total', size, kind='blocks')
+            for offset, length, _ in records:
+                self.__index.append((first_index, offset, length))
+            if valid_size < size:
+                # A torn or corrupted record: everything from here on can not be trusted.
+                print('Recovering the block store: discarding {} damaged bytes of {}.'.format(size - valid_size,
+                                                                                             path))
+                with open(path, mode='r+b') as f:
+                    f.truncate(valid_size)
+                for later_index in self.__segments[position + 1:]:
+                    os.remove(self.__segment_path(later_index))
+                self.__segments = self.__segments[:position + 1]
+                break
+
+    def __load_mempool(self):
+        if not os.path.exists(self.__mempool_path()):
+            return None
+        with open(self.__mempool_path(), mode='rb') as f:
+            records, valid_size = read_records(f)
+            size = f.seek(0, os.SEEK_END)
+        metrics.increment('storage_read_bytes_total', size, kind='mempool')
+        transactions = {}
+        for _, _, record in records:
+            if record['op'] == 'add':
+                transactions[record['transaction']['signature']] = record['transaction']
+            elif record['op'] == 'remove':
+                for signature in record['signatures']:
+                    transactions.pop(signature, None)
+        transactions = list(transactions.values())
+        if valid_size < size or len(records) > 2 * len(transactions):
+            # Compacts the journal, dropping the torn tail and the removed transactions.
+            self.reset_transactions(transactions)
+        return transactions
+
+    def __load_peers(self):
+        try:
+            with open(os.path.join(self.directory, 'peers.json'), mode='r') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return []
+
+    def __migrate_legacy_file(self):
+        """
+        Converts the former three-line JSON save file into the block store, once.
+        The store is written to a temporary directory which is renamed once complete, so a migration interrupted by a
+        crash leaves no store behind and is retried at the next start.
+        """
+        legacy_path = 'blockchain-{}.txt'.format(self.node_id)
+        try:
+            with open(legacy_path, mode='r') as f:
+                file_content = f.readlines()
+            blocks = json.loads(file_content[0])
+            transactions = json.loads(file_content[1])
+            peer_nodes = json.loads(file_content[2])
+        except (IOError, IndexError, ValueError):
+            return
+        directory = self.directory
+        temporary_directory = directory + '.migrating'
+        # The leftover of an interrupted migration.
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+        os.makedirs(temporary_directory)
+        self.directory = temporary_directory
+        try:
+            self.__segments = [0]
+            self.__write_atomically(self.__segment_path(0), b''.join(encode_record(block) for block in blocks))
+            self.reset_transactions(transactions)
+            self.save_peers(peer_nodes)
+        finally:
+            self.directory = directory
+        os.replace(temporary_directory, directory)
+        os.replace(legacy_path, legacy_path + '.migrated')
+        print('Migrated {} to the block store at {}.'.format(legacy_path, self.directory))
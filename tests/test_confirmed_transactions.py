@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from block import BLOCK_VERSION, Block
+from blockchain import MINING_REWARD, Blockchain
+from persistence import DURABILITY_IMMEDIATE
+from transaction import Transaction
+from utils import hash_util, merkle
+from utils.verification import ProofChecker
+from wallet import Wallet
+
+
+class ConfirmedTransactionReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.working_directory = os.getcwd()
+        self.data_directory = tempfile.mkdtemp(prefix='blockchain-test-')
+        # The block stores are created in the current directory.
+        os.chdir(self.data_directory)
+        self.wallet = Wallet(9001)
+        self.wallet.create_keys()
+        peer_wallet = Wallet(9002)
+        peer_wallet.create_keys()
+        self.miner = Blockchain(self.wallet.public_key, 9001, durability=DURABILITY_IMMEDIATE)
+        self.peer = Blockchain(peer_wallet.public_key, 9002, durability=DURABILITY_IMMEDIATE)
+        self.assertTrue(self.peer.add_block(self.miner.mine_block().to_dict()))
+        self.signature = self.wallet.sign_transaction(self.wallet.public_key, 'bob', 1.0)
+        self.assertTrue(self.miner.add_transaction('bob', 1.0, self.wallet.public_key, self.signature))
+        self.assertTrue(self.peer.add_block(self.miner.mine_block().to_dict()))
+
+    def tearDown(self):
+        self.miner.close()
+        self.peer.close()
+        os.chdir(self.working_directory)
+        shutil.rmtree(self.data_directory, ignore_errors=True)
+
+    def test_rebroadcast_after_block_is_not_accepted(self):
+        self.peer.add_transaction('bob', 1.0, self.wallet.public_key, self.signature, is_receiving=True)
+        self.assertEqual(self.peer.get_open_transactions(), [])
+        self.assertFalse(self.miner.add_transaction('bob', 1.0, self.wallet.public_key, self.signature))
+        self.assertEqual(self.miner.get_open_transactions(), [])
+
+    def test_rebroadcast_batch_after_block_is_not_accepted(self):
+        transaction = {'sender': self.wallet.public_key, 'recipient': 'bob', 'amount': 1.0,
+                       'signature': self.signature}
+        [(accepted, _)] = self.miner.add_transactions([transaction])
+        self.assertFalse(accepted)
+        self.assertEqual(self.miner.get_open_transactions(), [])
+
+    def test_block_confirming_a_transaction_again_is_rejected(self):
+        last_block = self.peer.get_chain()[-1]
+        transactions = [Transaction(self.wallet.public_key, 'bob', 1.0, self.signature),
+                        Transaction('MINING', self.wallet.public_key, MINING_REWARD, '')]
+        previous_hash = hash_util.hash_block(last_block)
+        merkle_root = merkle.compute_root(transactions)
+        proof = ProofChecker(None, previous_hash, merkle_root=merkle_root).search(0, 10 ** 7)
+        block = Block(last_block.index + 1, previous_hash, transactions, proof, version=BLOCK_VERSION,
+                      merkle_root=merkle_root)
+        self.assertFalse(self.peer.add_block(block.to_dict()))
+        self.assertEqual(self.peer.get_balance('bob'), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,11 @@
+import json
 from collections import OrderedDict
 
 from printable import Printable
 
 
 class Transaction(Printable):
+    __slots__ = ('sender', 'recipient', 'amount', 'signature')
 
     def __init__(self, sender, recipient, amount, signature):
         self.sender = sender
@@ -13,3 +15,36 @@ class Transaction(Printable):
 
     def to_ordered_dict(self):
         return OrderedDict([('sender', self.sender), ('recipient', self.recipient), ('amount', self.amount)])
+
+    def to_dict(self):
+        """
+        Converts the transaction into a plain dictionary, e.g. to send it as JSON.
+        :return: the dictionary representation of the transaction.
+        """
+        return {'sender': self.sender, 'recipient': self.recipient, 'amount': self.amount, 'signature': self.signature}
+
+    @classmethod
+    def from_dict(cls, transaction):
+        """
+        Creates a transaction from its dictionary representation.
+        :param transaction: the dictionary representation of the transaction.
+        :return: the new Transaction.
+        """
+        return cls(transaction['sender'], transaction['recipient'], transaction['amount'], transaction['signature'])
+
+    def has_valid_fields(self):
+        """
+        Checks the types of the fields, e.g. of a transaction received from a peer, before it is looked up by its
+        signature or its amount is compared to a balance.
+        :return: if the sender, recipient and signature are strings and the amount is a number.
+        """
+        return isinstance(self.sender, str) and isinstance(self.recipient, str) and isinstance(self.signature, str) \
+            and isinstance(self.amount, (int, float)) and not isinstance(self.amount, bool)
+
+    def get_canonical_bytes(self):
+        """
+        Returns the serialization of the transaction which is part of the block hash.
+        :return: the sorted JSON of the transaction, without its signature, as bytes.
+        """
+        return json.dumps({'amount': self.amount, 'recipient': self.recipient, 'sender': self.sender},
+                          sort_keys=True).encode()
@@ -1,7 +1,10 @@
 import hashlib as hl
 import json
 
-__all__ = ['hash_string_256', 'hash_block']
+__all__ = ['hash_string_256', 'hash_block', 'serialize_header', 'hash_header']
+
+# Fields of the header of a block which commits to its transactions through their Merkle root (version 2 and later).
+HEADER_FIELDS = ('version', 'index', 'previous_hash', 'merkle_root', 'proof', 'timestamp')
 
 
 def hash_string_256(string):
@@ -11,9 +14,27 @@ def hash_string_256(string):
 def hash_block(block):
     """
     Hashes a block and returns a string representation of it.
+    The hash is cached by the block, so hashing the same block again is free.
     :param block: The block that will be hashed.
     :return: a 256 hash representation of the parameter block.
     """
-    hashable_block = block.__dict__.copy()
-    hashable_block['transactions'] = [tx.to_ordered_dict() for tx in hashable_block['transactions']]
-    return hash_string_256(json.dumps(hashable_block, sort_keys=True).encode())
+    return block.get_hash()
+
+
+def serialize_header(header):
+    """
+    Serializes the header of a block which commits to its transactions through their Merkle root.
+    :param header: the header as a dictionary.
+    :return: the sorted JSON of the header fields as bytes.
+    """
+    return json.dumps({field: header[field] for field in HEADER_FIELDS}, sort_keys=True).encode()
+
+
+def hash_header(header):
+    """
+    Hashes the header of a block which commits to its transactions through their Merkle root. The result is
+    the hash of the whole block, so the chain of headers can be verified without the transactions.
+    :param header: the header as a dictionary.
+    :return: a 256 hash representation of the block.
+    """
+    return hash_string_256(serialize_header(header))
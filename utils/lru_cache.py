@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+
+__all__ = ['LRUCache']
+
+
+class LRUCache:
+
+    def __init__(self, max_size):
+        """
+        A bounded mapping which evicts the least recently used entries first.
+        :param max_size: the maximum number of entries kept in the cache.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the value of a key, marking it as recently used.
+        :param key: the key which is looked up.
+        :param default: the value returned when the key is not cached.
+        :return: the cached value or the default.
+        """
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return self.__entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Stores the value of a key, evicting the least recently used entry when the cache is full.
+        :param key: the key which is stored.
+        :param value: the value of the key.
+        """
+        with self.__lock:
+            self.__entries[key] = value
+            self.__entries.move_to_end(key)
+            if len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def clear(self):
+        """ Removes all the entries and resets the counters. """
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """ Returns the size and the hit/miss counters of the cache. """
+        return {'size': len(self.__entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
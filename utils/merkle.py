@@ -0,0 +1,84 @@
+import hashlib as hl
+import json
+
+__all__ = ['hash_transaction', 'compute_root', 'compute_proof', 'verify_proof']
+
+# Leaves and inner nodes are hashed with different prefixes, so an inner node can never pass for a transaction.
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def hash_transaction(transaction):
+    """
+    Hashes a transaction, including its signature, as a leaf of the Merkle tree.
+    :param transaction: the Transaction or its dictionary representation.
+    :return: the hash of the leaf as bytes.
+    """
+    if not isinstance(transaction, dict):
+        transaction = transaction.to_dict()
+    return hl.sha256(LEAF_PREFIX + json.dumps(transaction, sort_keys=True).encode()).digest()
+
+
+def compute_root(transactions):
+    """
+    Computes the Merkle root of the transactions of a block.
+    A node without a sibling is promoted to the next level unchanged instead of being paired with itself.
+    :param transactions: the transactions of the block.
+    :return: the hexadecimal Merkle root.
+    """
+    level = [hash_transaction(transaction) for transaction in transactions]
+    if len(level) == 0:
+        return hl.sha256(b'').hexdigest()
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0].hex()
+
+
+def compute_proof(transactions, position):
+    """
+    Computes the proof that a transaction is included in a block: the sibling hashes on the way to the root.
+    :param transactions: the transactions of the block.
+    :param position: the position of the proven transaction in the block.
+    :return: the list of siblings, from the leaf to the root, as dictionaries with the hexadecimal hash and the
+    side ('left' or 'right') of the sibling.
+    """
+    level = [hash_transaction(transaction) for transaction in transactions]
+    proof = []
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append({'hash': level[sibling].hex(), 'side': 'left' if sibling < position else 'right'})
+        level = _next_level(level)
+        position //= 2
+    return proof
+
+
+def verify_proof(transaction, proof, merkle_root):
+    """
+    Verifies that a transaction is included in a block, knowing only the Merkle root of its header.
+    :param transaction: the Transaction or its dictionary representation.
+    :param proof: the siblings returned by compute_proof.
+    :param merkle_root: the hexadecimal Merkle root of the block header.
+    :return: if the proof leads from the transaction to the Merkle root.
+    """
+    try:
+        node = hash_transaction(transaction)
+        for sibling in proof:
+            sibling_hash = bytes.fromhex(sibling['hash'])
+            if sibling['side'] == 'left':
+                node = hl.sha256(NODE_PREFIX + sibling_hash + node).digest()
+            elif sibling['side'] == 'right':
+                node = hl.sha256(NODE_PREFIX + node + sibling_hash).digest()
+            else:
+                return False
+    except (KeyError, TypeError, ValueError):
+        return False
+    return node.hex() == merkle_root
+
+
+def _next_level(level):
+    next_level = [hl.sha256(NODE_PREFIX + level[position] + level[position + 1]).digest()
+                  for position in range(0, len(level) - 1, 2)]
+    if len(level) % 2 == 1:
+        next_level.append(level[-1])
+    return next_level
@@ -0,0 +1,148 @@
+import threading
+import time
+from contextlib import contextmanager
+
+__all__ = ['enable', 'disable', 'is_enabled', 'describe', 'increment', 'set_gauge', 'observe', 'timer', 'render']
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_lock = threading.Lock()
+# Metric name -> (type, help text).
+_descriptions = {}
+# Metric name -> {labels: value}, where labels is a sorted tuple of (label, value) pairs.
+_counters = {}
+_gauges = {}
+# Metric name -> {labels: [bucket counts..., sum, count]}.
+_histograms = {}
+
+
+def enable():
+    """ Starts recording the metrics. """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """ Stops recording the metrics, so the instrumentation costs only a flag check. """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def describe(name, metric_type, help_text):
+    """
+    Registers the type and the help text of a metric for the exposition format.
+    :param name: the name of the metric.
+    :param metric_type: counter, gauge or histogram.
+    :param help_text: the description of the metric.
+    """
+    _descriptions[name] = (metric_type, help_text)
+
+
+def increment(name, value=1, **labels):
+    """
+    Increments a counter.
+    :param name: the name of the counter.
+    :param value: the amount added to the counter.
+    :param labels: the labels of the counter, e.g. peer='localhost:5001'.
+    """
+    if not _enabled:
+        return
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets the current value of a gauge.
+    :param name: the name of the gauge.
+    :param value: the current value.
+    :param labels: the labels of the gauge.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+
+def observe(name, value, **labels):
+    """
+    Records a value, usually a duration in seconds, in a histogram.
+    :param name: the name of the histogram.
+    :param value: the observed value.
+    :param labels: the labels of the histogram.
+    """
+    if not _enabled:
+        return
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        buckets = series.get(key)
+        if buckets is None:
+            buckets = series[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+        for (position, upper_bound) in enumerate(LATENCY_BUCKETS):
+            if value <= upper_bound:
+                buckets[position] += 1
+        buckets[-2] += value
+        buckets[-1] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Records the duration of the wrapped code in a histogram.
+    :param name: the name of the histogram.
+    :param labels: the labels of the histogram.
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def render():
+    """
+    Renders all the metrics in the Prometheus text exposition format.
+    :return: the metrics as a String.
+    """
+    lines = []
+    with _lock:
+        for (series_by_name, metric_type) in ((_counters, 'counter'), (_gauges, 'gauge')):
+            for name in sorted(series_by_name):
+                _render_header(lines, name, metric_type)
+                for (labels, value) in sorted(series_by_name[name].items()):
+                    lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+        for name in sorted(_histograms):
+            _render_header(lines, name, 'histogram')
+            for (labels, buckets) in sorted(_histograms[name].items()):
+                for (position, upper_bound) in enumerate(LATENCY_BUCKETS):
+                    lines.append('{}_bucket{} {}'.format(name, _format_labels(labels + (('le', upper_bound),)),
+                                                          buckets[position]))
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(labels + (('le', '+Inf'),)), buckets[-1]))
+                lines.append('{}_sum{} {}'.format(name, _format_labels(labels), buckets[-2]))
+                lines.append('{}_count{} {}'.format(name, _format_labels(labels), buckets[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def _render_header(lines, name, metric_type):
+    help_text = _descriptions.get(name, (metric_type, name))[1]
+    lines.append('# HELP {} {}'.format(name, help_text))
+    lines.append('# TYPE {} {}'.format(name, metric_type))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for (label, value) in labels) + '}'
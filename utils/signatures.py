@@ -0,0 +1,128 @@
+import binascii
+
+import Crypto.Random
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import PKCS1_v1_5, eddsa
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+except ImportError:
+    Ed25519PrivateKey = None
+
+__all__ = ['RSA_SCHEME', 'ED25519_SCHEME', 'SCHEMES', 'ED25519_BACKEND', 'get_scheme', 'generate_keys', 'load_signer',
+           'load_verifier']
+
+RSA_SCHEME = 'rsa'
+ED25519_SCHEME = 'ed25519'
+SCHEMES = (RSA_SCHEME, ED25519_SCHEME)
+
+# The keys and signatures of the newer schemes start with the name of their scheme and this separator. The RSA keys
+# and signatures have no tag, so the existing wallets and chains are unchanged.
+TAG_SEPARATOR = ':'
+RSA_KEY_SIZE = 1024
+# The optional cryptography package signs and verifies Ed25519 several times faster than RSA. Without it, the pure
+# Python implementation of pycryptodome is used, which is slower than RSA. Both produce the same signatures.
+ED25519_BACKEND = 'cryptography' if Ed25519PrivateKey is not None else 'pycryptodome'
+
+
+def get_scheme(value):
+    """
+    Returns the signature scheme of a key or a signature from its tag.
+    :param value: the hexadecimal key or signature, possibly prefixed by the tag of its scheme.
+    :return: the name of the scheme, or None if the tag is unknown.
+    """
+    tag, separator, _ = value.partition(TAG_SEPARATOR)
+    if not separator:
+        return RSA_SCHEME
+    return tag if tag in SCHEMES and tag != RSA_SCHEME else None
+
+
+def generate_keys(scheme=RSA_SCHEME):
+    """
+    Generates a new pair of keys.
+    :param scheme: the name of the signature scheme.
+    :return: the private and the public key as tagged hexadecimal strings.
+    """
+    if scheme == RSA_SCHEME:
+        private_key = RSA.generate(RSA_KEY_SIZE, Crypto.Random.new().read)
+        return (binascii.hexlify(private_key.exportKey(format='DER')).decode('ascii'),
+                binascii.hexlify(private_key.publickey().exportKey(format='DER')).decode('ascii'))
+    if scheme == ED25519_SCHEME:
+        private_key = ECC.generate(curve='Ed25519')
+        return (_tag(scheme, private_key.seed), _tag(scheme, private_key.public_key().export_key(format='raw')))
+    raise ValueError('Unknown signature scheme: {}'.format(scheme))
+
+
+def load_signer(private_key):
+    """
+    Imports a private key.
+    :param private_key: the tagged hexadecimal private key.
+    :return: a function signing a message given as bytes and returning the tagged hexadecimal signature.
+    :raises ValueError: when the key is malformed or its scheme is unknown.
+    """
+    scheme, raw_key = _untag(private_key)
+    if scheme == RSA_SCHEME:
+        signer = PKCS1_v1_5.new(RSA.importKey(raw_key))
+        return lambda message: binascii.hexlify(signer.sign(SHA256.new(message))).decode('ascii')
+    if Ed25519PrivateKey is not None:
+        private_key = Ed25519PrivateKey.from_private_bytes(raw_key)
+        return lambda message: _tag(scheme, private_key.sign(message))
+    signer = eddsa.new(eddsa.import_private_key(raw_key), 'rfc8032')
+    return lambda message: _tag(scheme, signer.sign(message))
+
+
+def load_verifier(public_key):
+    """
+    Imports a public key.
+    :param public_key: the tagged hexadecimal public key.
+    :return: a function telling if a tagged hexadecimal signature of a message given as bytes is valid. A signature
+    of another scheme than the key is invalid.
+    :raises ValueError: when the key is malformed or its scheme is unknown.
+    """
+    scheme, raw_key = _untag(public_key)
+    if scheme == RSA_SCHEME:
+        verifier = PKCS1_v1_5.new(RSA.importKey(raw_key))
+
+        def verify(message, signature):
+            return get_scheme(signature) == scheme and verifier.verify(SHA256.new(message),
+                                                                       binascii.unhexlify(signature))
+    elif Ed25519PrivateKey is not None:
+        public_key = Ed25519PublicKey.from_public_bytes(raw_key)
+
+        def verify(message, signature):
+            signature_scheme, raw_signature = _untag(signature)
+            if signature_scheme != scheme:
+                return False
+            try:
+                public_key.verify(raw_signature, message)
+            except InvalidSignature:
+                return False
+            return True
+    else:
+        verifier = eddsa.new(eddsa.import_public_key(raw_key), 'rfc8032')
+
+        def verify(message, signature):
+            signature_scheme, raw_signature = _untag(signature)
+            if signature_scheme != scheme:
+                return False
+            try:
+                verifier.verify(message, raw_signature)
+            except ValueError:
+                return False
+            return True
+    return verify
+
+
+def _tag(scheme, raw):
+    return scheme + TAG_SEPARATOR + raw.hex()
+
+
+def _untag(value):
+    scheme = get_scheme(value)
+    if scheme is None:
+        raise ValueError('Unknown signature scheme of {!r}'.format(value[:16]))
+    if scheme == RSA_SCHEME:
+        return scheme, binascii.unhexlify(value)
+    return scheme, bytes.fromhex(value[len(scheme) + len(TAG_SEPARATOR):])
@@ -1,41 +1,186 @@
-from utils import hash_util
+import hashlib as hl
+
+from block import LEGACY_BLOCK_VERSION, SUPPORTED_BLOCK_VERSIONS
+from utils import hash_util, merkle, metrics
 from wallet import Wallet
 
+# Number of leading hexadecimal zeros the hash of a valid proof of work must have.
+PROOF_DIFFICULTY = 2
+
+metrics.describe('verification_valid_proof_total', 'counter', 'Proofs of work checked by Verification.valid_proof.')
+
+
+class ProofChecker:
+
+    def __init__(self, transactions, last_hash, difficulty=PROOF_DIFFICULTY, merkle_root=None):
+        """
+        Prepares the checking of many proof guesses for the same block.
+        The transactions and the previous hash are serialized and hashed only once, every guess then
+        continues from a copy of that hashing state.
+        :param transactions: the transactions of the block for which the proofs are checked, without the reward.
+        :param last_hash: the previous block hash which is part of every guess.
+        :param difficulty: the number of leading hexadecimal zeros of a valid hash.
+        :param merkle_root: the Merkle root of all the transactions, including the reward, which replaces the list of
+        transactions in the guesses of the blocks committing to a Merkle root.
+        """
+        if merkle_root is not None:
+            prefix = (merkle_root + str(last_hash)).encode()
+        else:
+            prefix = (str([transaction.to_ordered_dict() for transaction in transactions]) + str(last_hash)).encode()
+        self.__prefix_state = hl.sha256(prefix)
+        # Two hexadecimal zeros are one zero byte, an odd one is a byte below 0x10.
+        self.__zero_bytes, self.__zero_nibble = divmod(difficulty, 2)
+        self.__zero_prefix = bytes(self.__zero_bytes)
+
+    def is_valid(self, proof):
+        """
+        Checks a single proof guess, with the same result as Verification.valid_proof.
+        :param proof: the proof number we are testing.
+        :return: if the hash of the guess satisfies the difficulty.
+        """
+        guess = self.__prefix_state.copy()
+        guess.update(str(proof).encode())
+        digest = guess.digest()
+        return digest.startswith(self.__zero_prefix) and (not self.__zero_nibble or digest[self.__zero_bytes] < 0x10)
+
+    def search(self, start, stop):
+        """
+        Checks the proof guesses of a range in order.
+        :param start: the first proof number which is tested.
+        :param stop: the proof number where the search stops (exclusive).
+        :return: the first valid proof of the range or None if there is none.
+        """
+        prefix_state = self.__prefix_state
+        zero_prefix = self.__zero_prefix
+        zero_bytes = self.__zero_bytes
+        zero_nibble = self.__zero_nibble
+        for proof in range(start, stop):
+            guess = prefix_state.copy()
+            guess.update(str(proof).encode())
+            digest = guess.digest()
+            if digest.startswith(zero_prefix) and (not zero_nibble or digest[zero_bytes] < 0x10):
+                return proof
+        return None
+
 
 class Verification:
 
     @staticmethod
-    def valid_proof(transactions, last_hash, proof):
+    def valid_proof(transactions, last_hash, proof, merkle_root=None):
         """
         Validates a proof of work number to check if it is valid to solve the hash algorithm.
         :param transactions: the transactions of the block for whick the proof is validated.
         :param last_hash: the previous block hash which will be store in the current guess for the hash.
         :param proof: the proof number we are testing.
+        :param merkle_root: the Merkle root of a block committing to one, used instead of the transactions.
         :return: if the generated hash is a valid hash based on the given condition.
         """
-        # Creates a String containing all the hash inputs.
-        guess = (str([transaction.to_ordered_dict() for transaction in transactions]) + str(last_hash) + str(
-            proof)).encode()
-        # Hashes the String.
-        guess_hash = hash_util.hash_string_256(guess)
-        # Only a hash based on the above inputs that starts with two 0s is valid for the algorithm.
+        metrics.increment('verification_valid_proof_total')
+        # Only a hash of the transactions, the previous hash and the proof that starts with two 0s is valid.
         # This condition can be changed, but once adding more characters to validate, the more time consuming it is.
-        return guess_hash[0:2] == '00'
+        return ProofChecker(transactions, last_hash, merkle_root=merkle_root).is_valid(proof)
 
     @classmethod
-    def verify_chain(cls, blockchain):
-        """ Verifies if the blockchain was not manipulated. """
-        # When enumerating a list, it returns a pair of index and value (tuple)
-        for (index, block) in enumerate(blockchain):
-            if index == 0:  # Genesis block
-                continue
-            if block.previous_hash != hash_util.hash_block(blockchain[index - 1]):
-                return False
-            if not cls.valid_proof(block.transactions[:-1], block.previous_hash, block.proof):
-                print("Proof of Work is invalid!")
+    def verify_block(cls, block):
+        """
+        Verifies the proof of work of a block and, if its header has a Merkle root, that the root matches
+        its transactions. The link to the previous block is not checked.
+        :param block: the Block which is verified.
+        :return: if the block is valid.
+        """
+        if block.version not in SUPPORTED_BLOCK_VERSIONS:
+            print('Unsupported block version {}!'.format(block.version))
+            return False
+        if block.version == LEGACY_BLOCK_VERSION:
+            return cls.valid_proof(block.transactions[:-1], block.previous_hash, block.proof)
+        if block.merkle_root != merkle.compute_root(block.transactions):
+            print('The Merkle root does not match the transactions of the block!')
+            return False
+        return cls.valid_proof(None, block.previous_hash, block.proof, block.merkle_root)
+
+    @classmethod
+    def verify_headers(cls, headers, start_index=1):
+        """
+        Verifies a chain of block headers without the transactions, e.g. in a light client.
+        The headers of legacy blocks do not commit to their transactions, so their hash and proof of work can not be
+        checked and are trusted; the verification is complete from the first block with a Merkle root on.
+        :param headers: the headers as dictionaries, as returned by Block.get_header.
+        :param start_index: the index of the first header to verify, the previous ones were already verified.
+        :return: if the chain of headers is valid.
+        """
+        try:
+            for index in range(max(start_index, 1), len(headers)):
+                previous_header = headers[index - 1]
+                header = headers[index]
+                if header['version'] not in SUPPORTED_BLOCK_VERSIONS or header['version'] < previous_header['version']:
+                    return False
+                if previous_header['version'] == LEGACY_BLOCK_VERSION:
+                    previous_hash = previous_header['hash']
+                else:
+                    previous_hash = hash_util.hash_header(previous_header)
+                if header['previous_hash'] != previous_hash:
+                    return False
+                if header['version'] != LEGACY_BLOCK_VERSION and not cls.valid_proof(
+                        None, header['previous_hash'], header['proof'], header['merkle_root']):
+                    return False
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    @staticmethod
+    def verify_inclusion(transaction, proof, header):
+        """
+        Verifies that a transaction is included in a block, knowing only the header of the block.
+        :param transaction: the Transaction or its dictionary representation.
+        :param proof: the Merkle proof of the transaction.
+        :param header: the verified header of the block, which must commit to a Merkle root.
+        :return: if the transaction is included in the block.
+        """
+        merkle_root = header.get('merkle_root')
+        return merkle_root is not None and merkle.verify_proof(transaction, proof, merkle_root)
+
+    @classmethod
+    def verify_chain(cls, blockchain, start_index=1):
+        """
+        Verifies if the blockchain was not manipulated.
+        :param blockchain: the blocks which are verified.
+        :param start_index: the index of the first block to verify. The blocks before it were already verified,
+        e.g. when only a new suffix was added to a known chain.
+        :return: if the blockchain is valid.
+        """
+        # The genesis block has no previous block to check.
+        for index in range(max(start_index, 1), len(blockchain)):
+            if not cls.verify_next_block(blockchain[index], blockchain[index - 1]):
                 return False
         return True
 
+    @staticmethod
+    def verify_link(block, previous_block):
+        """
+        Verifies that a block can follow another one: it must point to the hash of the previous block and can not
+        switch back to an older block version.
+        :param block: the Block which is verified.
+        :param previous_block: the Block before it.
+        :return: if the block can follow the previous block.
+        """
+        return block.previous_hash == hash_util.hash_block(previous_block) and block.version >= previous_block.version
+
+    @classmethod
+    def verify_next_block(cls, block, previous_block):
+        """
+        Verifies a block of a chain: its link to the previous block, its proof of work and its Merkle root.
+        The signatures of its transactions are not checked.
+        :param block: the Block which is verified.
+        :param previous_block: the Block before it.
+        :return: if the block is valid.
+        """
+        if not cls.verify_link(block, previous_block):
+            return False
+        if not cls.verify_block(block):
+            print("Proof of Work is invalid!")
+            return False
+        return True
+
     @staticmethod
     def verify_transaction(transaction, get_balance, check_funds=True):
         """
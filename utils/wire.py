@@ -0,0 +1,288 @@
+import struct
+
+__all__ = ['CONTENT_TYPE', 'UnsupportedVersionError', 'encode_transaction', 'decode_transaction', 'encode_block',
+           'decode_block', 'encode_blocks', 'iter_encode_blocks', 'decode_blocks']
+
+# Media type of the binary wire format, negotiated with the Content-Type and Accept headers.
+CONTENT_TYPE = 'application/x-blockchain-wire'
+# Every message starts with the magic bytes, the version of the format and the kind of message.
+MAGIC = b'BCW'
+# Version 2 added the version and the Merkle root of the blocks.
+VERSION = 2
+MESSAGE_HEADER = struct.Struct('>3sBB')
+TRANSACTION_MESSAGE = 1
+BLOCK_MESSAGE = 2
+BLOCKS_MESSAGE = 3
+
+# Text fields which are hexadecimal strings, like the keys, signatures and hashes, are sent as their raw bytes.
+# A string which already appeared in the same block is sent as a reference to its first appearance.
+_TEXT = 0
+_HEX = 1
+_REFERENCE = 2
+# Numbers keep their JSON type, because the hash of a block depends on it (10 and 10.0 are different).
+_INTEGER = 0
+_FLOAT = 1
+
+_FIELD_HEADER = struct.Struct('>BH')
+_INTEGER_FIELD = struct.Struct('>Bq')
+_FLOAT_FIELD = struct.Struct('>Bd')
+# Index and version of a block.
+_BLOCK_PREFIX = struct.Struct('>QB')
+_COUNT = struct.Struct('>I')
+# Block version whose blocks have no version and Merkle root fields.
+_LEGACY_BLOCK_VERSION = 1
+
+
+class UnsupportedVersionError(ValueError):
+    """ Raised when a message is in another version of the wire format, e.g. from a peer running another release. """
+    pass
+
+
+def encode_transaction(transaction):
+    """
+    Encodes a transaction for the /broadcast route.
+    :param transaction: the transaction as a dictionary with sender, recipient, amount and signature.
+    :return: the message as bytes.
+    :raises ValueError: when a value can not be represented in the wire format.
+    """
+    parts = [MESSAGE_HEADER.pack(MAGIC, VERSION, TRANSACTION_MESSAGE)]
+    _encode_transaction(transaction, parts)
+    return b''.join(parts)
+
+
+def decode_transaction(data):
+    """
+    Decodes a transaction message.
+    :param data: the message as bytes.
+    :return: the transaction as a dictionary, as if it was sent as JSON.
+    :raises ValueError: when the message is malformed.
+    """
+    try:
+        offset = _read_message_header(data, TRANSACTION_MESSAGE)
+        transaction, offset = _decode_transaction(data, offset, [])
+    except (struct.error, IndexError):
+        raise ValueError('The message is truncated or malformed!')
+    _check_end(data, offset)
+    return transaction
+
+
+def encode_block(block):
+    """
+    Encodes a block for the /broadcastBlock route.
+    :param block: the block as a dictionary.
+    :return: the message as bytes.
+    :raises ValueError: when a value can not be represented in the wire format.
+    """
+    parts = [MESSAGE_HEADER.pack(MAGIC, VERSION, BLOCK_MESSAGE)]
+    _encode_block(block, parts)
+    return b''.join(parts)
+
+
+def decode_block(data):
+    """
+    Decodes a block message.
+    :param data: the message as bytes.
+    :return: the block as a dictionary, as if it was sent as JSON.
+    :raises ValueError: when the message is malformed.
+    """
+    try:
+        offset = _read_message_header(data, BLOCK_MESSAGE)
+        block, offset = _decode_block(data, offset)
+    except (struct.error, IndexError):
+        raise ValueError('The message is truncated or malformed!')
+    _check_end(data, offset)
+    return block
+
+
+def encode_blocks(blocks):
+    """
+    Encodes a list of blocks, e.g. the chain.
+    :param blocks: the blocks as dictionaries.
+    :return: the message as bytes.
+    :raises ValueError: when a value can not be represented in the wire format.
+    """
+    return b''.join(iter_encode_blocks(blocks, len(blocks)))
+
+
+def iter_encode_blocks(blocks, count):
+    """
+    Encodes a list of blocks piece by piece, so a long chain can be streamed without encoding it at once.
+    Every block is a record prefixed by its length.
+    :param blocks: an iterable of the blocks as dictionaries.
+    :param count: the number of blocks.
+    :return: a generator of the pieces of the message as bytes.
+    """
+    yield MESSAGE_HEADER.pack(MAGIC, VERSION, BLOCKS_MESSAGE) + _COUNT.pack(count)
+    for block in blocks:
+        parts = []
+        _encode_block(block, parts)
+        record = b''.join(parts)
+        yield _COUNT.pack(len(record)) + record
+
+
+def decode_blocks(data):
+    """
+    Decodes a list of blocks.
+    :param data: the message as bytes.
+    :return: the list of blocks as dictionaries, as if they were sent as JSON.
+    :raises ValueError: when the message is malformed.
+    """
+    blocks = []
+    try:
+        offset = _read_message_header(data, BLOCKS_MESSAGE)
+        (count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        for _ in range(count):
+            (length,) = _COUNT.unpack_from(data, offset)
+            offset += _COUNT.size
+            block, end = _decode_block(data, offset)
+            if end != offset + length:
+                raise ValueError('The length of a block record does not match its content!')
+            blocks.append(block)
+            offset = end
+    except (struct.error, IndexError):
+        raise ValueError('The message is truncated or malformed!')
+    _check_end(data, offset)
+    return blocks
+
+
+def _encode_block(block, parts):
+    # The strings of a block are numbered in order of appearance, so repeated keys are sent only once per block.
+    strings = {}
+    version = block.get('version', _LEGACY_BLOCK_VERSION)
+    try:
+        parts.append(_BLOCK_PREFIX.pack(block['index'], version))
+    except struct.error:
+        raise ValueError('The index {!r} or the version {!r} of the block can not be represented in the wire '
+                         'format!'.format(block['index'], version))
+    _encode_text(block['previous_hash'], parts, strings)
+    if version != _LEGACY_BLOCK_VERSION:
+        _encode_text(block['merkle_root'], parts, strings)
+    _encode_number(block['proof'], parts)
+    _encode_number(block['timestamp'], parts)
+    parts.append(_COUNT.pack(len(block['transactions'])))
+    for transaction in block['transactions']:
+        _encode_transaction(transaction, parts, strings)
+
+
+def _decode_block(data, offset):
+    strings = []
+    index, version = _BLOCK_PREFIX.unpack_from(data, offset)
+    previous_hash, offset = _decode_text(data, offset + _BLOCK_PREFIX.size, strings)
+    merkle_root = None
+    if version != _LEGACY_BLOCK_VERSION:
+        merkle_root, offset = _decode_text(data, offset, strings)
+    proof, offset = _decode_number(data, offset)
+    timestamp, offset = _decode_number(data, offset)
+    (count,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    transactions = []
+    for _ in range(count):
+        transaction, offset = _decode_transaction(data, offset, strings)
+        transactions.append(transaction)
+    block = {'index': index, 'previous_hash': previous_hash, 'transactions': transactions, 'proof': proof,
+             'timestamp': timestamp}
+    if version != _LEGACY_BLOCK_VERSION:
+        block['version'] = version
+        block['merkle_root'] = merkle_root
+    return block, offset
+
+
+def _encode_transaction(transaction, parts, strings=None):
+    if strings is None:
+        strings = {}
+    _encode_text(transaction['sender'], parts, strings)
+    _encode_text(transaction['recipient'], parts, strings)
+    _encode_number(transaction['amount'], parts)
+    _encode_text(transaction['signature'], parts, strings)
+
+
+def _decode_transaction(data, offset, strings):
+    sender, offset = _decode_text(data, offset, strings)
+    recipient, offset = _decode_text(data, offset, strings)
+    amount, offset = _decode_number(data, offset)
+    signature, offset = _decode_text(data, offset, strings)
+    return {'sender': sender, 'recipient': recipient, 'amount': amount, 'signature': signature}, offset
+
+
+def _encode_text(text, parts, strings):
+    if not isinstance(text, str):
+        raise ValueError('Expected a string, got {!r}!'.format(text))
+    position = strings.get(text)
+    if position is not None:
+        parts.append(_FIELD_HEADER.pack(_REFERENCE, position))
+        return
+    try:
+        raw = bytes.fromhex(text)
+        # Only lowercase hexadecimal strings come back unchanged from the raw bytes.
+        kind = _HEX if raw.hex() == text else _TEXT
+    except ValueError:
+        kind = _TEXT
+    if kind == _TEXT:
+        raw = text.encode()
+    if len(raw) > 0xFFFF:
+        raise ValueError('A string of {} bytes is too long for the wire format!'.format(len(raw)))
+    if len(strings) <= 0xFFFF:
+        strings[text] = len(strings)
+    parts.append(_FIELD_HEADER.pack(kind, len(raw)))
+    parts.append(raw)
+
+
+def _decode_text(data, offset, strings, unpack_field_header=_FIELD_HEADER.unpack_from,
+                 field_header_size=_FIELD_HEADER.size):
+    # The structures are bound as defaults because this is called for every string of every transaction.
+    kind, length = unpack_field_header(data, offset)
+    start = offset + field_header_size
+    if kind == _REFERENCE:
+        return strings[length], start
+    end = start + length
+    if end > len(data):
+        raise ValueError('The message is truncated!')
+    if kind == _HEX:
+        text = data[start:end].hex()
+    elif kind == _TEXT:
+        text = bytes(data[start:end]).decode()
+    else:
+        raise ValueError('Unknown kind of string: {}!'.format(kind))
+    if len(strings) <= 0xFFFF:
+        strings.append(text)
+    return text, end
+
+
+def _encode_number(number, parts):
+    if isinstance(number, bool):
+        raise ValueError('Expected a number, got {!r}!'.format(number))
+    if isinstance(number, int):
+        try:
+            parts.append(_INTEGER_FIELD.pack(_INTEGER, number))
+        except struct.error:
+            raise ValueError('The integer {} is too large for the wire format!'.format(number))
+    elif isinstance(number, float):
+        parts.append(_FLOAT_FIELD.pack(_FLOAT, number))
+    else:
+        raise ValueError('Expected a number, got {!r}!'.format(number))
+
+
+def _decode_number(data, offset):
+    kind = data[offset]
+    if kind == _INTEGER:
+        return _INTEGER_FIELD.unpack_from(data, offset)[1], offset + _INTEGER_FIELD.size
+    if kind == _FLOAT:
+        return _FLOAT_FIELD.unpack_from(data, offset)[1], offset + _FLOAT_FIELD.size
+    raise ValueError('Unknown kind of number: {}!'.format(kind))
+
+
+def _read_message_header(data, expected_message):
+    magic, version, message = MESSAGE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a message of the wire format!')
+    if version != VERSION:
+        raise UnsupportedVersionError('Version {} of the wire format is not supported!'.format(version))
+    if message != expected_message:
+        raise ValueError('Unexpected kind of message: {}!'.format(message))
+    return MESSAGE_HEADER.size
+
+
+def _check_end(data, offset):
+    if offset != len(data):
+        raise ValueError('Unexpected bytes after the end of the message!')
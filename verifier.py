@@ -0,0 +1,168 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+from block import Block
+from storage import DamagedStoreError, read_stored_blocks
+from utils.verification import Verification
+from wallet import Wallet
+
+# Below this number of blocks the chain is verified in the current process.
+PARALLEL_VERIFICATION_THRESHOLD = 64
+# Minimum number of blocks sent to a verification process at once.
+MIN_RANGE_SIZE = 16
+# Number of ranges per worker, so a worker finishing early takes over the remaining ranges.
+RANGES_PER_WORKER = 4
+
+
+def _to_block(block):
+    if isinstance(block, Block):
+        return block
+    if isinstance(block, (bytes, bytearray)):
+        block = json.loads(block)
+    return Block.from_dict(block)
+
+
+def _find_invalid_block(blocks, first_index, check_signatures):
+    """
+    Verifies a range of blocks against each other and against the block before the range.
+    :param blocks: the block before the range followed by the blocks of the range, as Blocks, dictionaries or
+    JSON bytes.
+    :param first_index: the index in the chain of the first block of the range.
+    :param check_signatures: if the signatures of the transactions are verified too.
+    :return: the index in the chain of the first invalid block or None if the range is valid.
+    """
+    previous_block = _to_block(blocks[0])
+    for offset in range(1, len(blocks)):
+        index = first_index + offset - 1
+        try:
+            block = _to_block(blocks[offset])
+        except (KeyError, TypeError, ValueError):
+            return index
+        if not Verification.verify_next_block(block, previous_block):
+            return index
+        if check_signatures:
+            try:
+                if not all(Wallet.verify_transaction(transaction) for transaction in block.transactions):
+                    return index
+            except (TypeError, ValueError, IndexError):
+                return index
+        previous_block = block
+    return None
+
+
+class ChainVerifier:
+
+    def __init__(self, workers=None, threshold=PARALLEL_VERIFICATION_THRESHOLD):
+        """
+        Verifies whole chains, splitting them into ranges of blocks which are verified in parallel processes.
+        :param workers: the number of verification processes. None uses one per CPU core.
+        :param threshold: the number of blocks below which a chain is verified in the current process.
+        """
+        self.workers = max(1, workers or multiprocessing.cpu_count())
+        self.threshold = threshold
+        self.__pool = None
+
+    def find_invalid_block(self, blocks, start_index=1, check_signatures=False):
+        """
+        Looks for the first invalid block of a chain: a broken link to the previous block, a version going back,
+        an invalid Merkle root or proof of work and, if requested, an invalid signature.
+        :param blocks: the blocks of the chain, as Blocks, dictionaries or JSON bytes.
+        :param start_index: the index of the first block to verify. The blocks before it were already verified.
+        :param check_signatures: if the signatures of the transactions are verified too.
+        :return: the index of the first invalid block or None if the chain is valid.
+        """
+        start_index = max(start_index, 1)
+        count = len(blocks) - start_index
+        if count <= 0:
+            return None
+        if self.workers == 1 or count < self.threshold:
+            return _find_invalid_block(blocks[start_index - 1:], start_index, check_signatures)
+
+        range_size = max(MIN_RANGE_SIZE, -(-count // (self.workers * RANGES_PER_WORKER)))
+        pool = self.__get_pool()
+        futures = []
+        for first_index in range(start_index, len(blocks), range_size):
+            # Every range starts with the block before it, so the links between the ranges are checked too.
+            blocks_range = [block.to_dict() if isinstance(block, Block) else block
+                            for block in blocks[first_index - 1:first_index + range_size]]
+            futures.append(pool.submit(_find_invalid_block, blocks_range, first_index, check_signatures))
+        # The ranges are checked in order, so the first invalid block is found even if a later range fails first.
+        for range_number, future in enumerate(futures):
+            invalid_index = future.result()
+            if invalid_index is not None:
+                for pending_future in futures[range_number + 1:]:
+                    pending_future.cancel()
+                return invalid_index
+        return None
+
+    def verify(self, blocks, start_index=1, check_signatures=False):
+        """
+        Verifies if a chain was not manipulated.
+        :return: if the chain is valid.
+        """
+        return self.find_invalid_block(blocks, start_index, check_signatures) is None
+
+    def close(self):
+        """ Stops the worker processes. """
+        if self.__pool is not None:
+            self.__pool.shutdown(cancel_futures=True)
+            self.__pool = None
+
+    def __get_pool(self):
+        if self.__pool is None:
+            self.__pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.__pool
+
+
+def load_blocks(path):
+    """
+    Loads the blocks to verify offline, without changing the files.
+    :param path: a legacy blockchain-<port>.txt save file or a blockchain-<port> block store directory.
+    :return: the blocks as dictionaries or JSON bytes.
+    :raises DamagedStoreError: when a record of the block store is damaged.
+    """
+    if os.path.isdir(path):
+        return read_stored_blocks(path)
+    with open(path, mode='r') as f:
+        return json.loads(f.readline())
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Verifies a saved blockchain offline.')
+    parser.add_argument('path', help='a blockchain-<port>.txt save file or a blockchain-<port> block store directory')
+    parser.add_argument('--workers', type=int, default=None, help='number of verification processes (default: one '
+                                                                  'per CPU core, 1 verifies in this process)')
+    parser.add_argument('--signatures', action='store_true', help='verify the signatures of the transactions too')
+    args = parser.parse_args(argv)
+
+    try:
+        blocks = load_blocks(args.path)
+    except DamagedStoreError as error:
+        # The blocks after a damaged record are unknown, so the chain can not be reported as valid.
+        print('The block store {} is damaged: {}'.format(args.path, error))
+        return 1
+    except (IOError, ValueError) as error:
+        print('Could not read {}: {}'.format(args.path, error))
+        return 2
+    verifier = ChainVerifier(args.workers)
+    start = time.perf_counter()
+    try:
+        invalid_index = verifier.find_invalid_block(blocks, check_signatures=args.signatures)
+    finally:
+        verifier.close()
+    elapsed = time.perf_counter() - start
+    print('Verified {} blocks in {:.3f}s with {} worker(s).'.format(len(blocks), elapsed, verifier.workers))
+    if invalid_index is not None:
+        print('The block {} is invalid!'.format(invalid_index))
+        return 1
+    print('The chain is valid.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,45 @@
-import binascii
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-import Crypto.Random
-from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5
+from utils import metrics, signatures
+from utils.lru_cache import LRUCache
+
+# Below this number of transactions the signatures are verified in the current process.
+PARALLEL_VERIFICATION_THRESHOLD = 64
+# Number of transactions sent to a verification process at once.
+VERIFICATION_CHUNK_SIZE = 32
+
+# Number of verified (sender, signed message, signature) tuples remembered by each process.
+VERIFIED_SIGNATURES_CACHE_SIZE = 100000
+# Number of parsed keys remembered by each process.
+KEYS_CACHE_SIZE = 1024
+
+metrics.describe('wallet_signature_verifications_total', 'counter', 'Signature verifications, by scheme and result.')
+
+# Processes verifying signatures in parallel, created on first use.
+_verification_pool = None
+
+
+def _verify_chunk(transactions):
+    return [Wallet.verify_transaction(transaction) for transaction in transactions]
 
 
 class Wallet:
+    # Transactions whose signatures were already found valid, so they are not verified again.
+    _verified_signatures = LRUCache(VERIFIED_SIGNATURES_CACHE_SIZE)
+    # Signature verifiers and signers of the already imported public and private keys.
+    _public_keys = LRUCache(KEYS_CACHE_SIZE)
+    _private_keys = LRUCache(KEYS_CACHE_SIZE)
 
-    def __init__(self, node_id):
+    def __init__(self, node_id, scheme=signatures.RSA_SCHEME):
+        """
+        :param node_id: the id of the node, which names the file of the keys.
+        :param scheme: the signature scheme of the keys created by create_keys. The loaded keys keep their own scheme.
+        """
         self.private_key = None
         self.public_key = None
         self.node_id = node_id
+        self.scheme = scheme
 
     def create_keys(self):
         """
@@ -54,13 +82,10 @@ class Wallet:
 
     def generate_keys(self):
         """
-        Generates a new pair of public and private keys using a cryptography algorithm.
-        :return:
+        Generates a new pair of public and private keys using the signature scheme of the wallet.
+        :return: the private and the public key as hexadecimal strings, tagged with their scheme unless it is RSA.
         """
-        private_key = RSA.generate(1024, Crypto.Random.new().read)
-        public_key = private_key.publickey()
-        return (binascii.hexlify(private_key.exportKey(format='DER')).decode('ascii'),
-                binascii.hexlify(public_key.exportKey(format='DER')).decode('ascii'))
+        return signatures.generate_keys(self.scheme)
 
     def sign_transaction(self, sender, recipient, amount):
         """
@@ -70,10 +95,11 @@ class Wallet:
         :param amount: the amount of coins of the transaction.
         :return: the signature for the given transaction.
         """
-        signer = PKCS1_v1_5.new(RSA.importKey(binascii.unhexlify(self.private_key)))
-        h = SHA256.new((str(sender) + str(recipient) + str(amount)).encode('utf8'))
-        signature = signer.sign(h)
-        return binascii.hexlify(signature).decode('ascii')
+        signer = Wallet._private_keys.get(self.private_key)
+        if signer is None:
+            signer = signatures.load_signer(self.private_key)
+            Wallet._private_keys.put(self.private_key, signer)
+        return signer(Wallet.__get_message(sender, recipient, amount))
 
     @staticmethod
     def verify_transaction(transaction):
@@ -82,10 +108,112 @@ class Wallet:
         :param transaction: the transaction that should have its signature validated.
         :return: if the signature of the transaction is valid or not.
         """
+        if Wallet.__is_verified(transaction):
+            return True
+        valid = Wallet.__verify_signature(transaction)
+        if valid:
+            Wallet.__remember_verified(transaction)
+        return valid
+
+    @staticmethod
+    def verify_transactions(transactions, stop_on_failure=False):
+        """
+        Verifies the signatures of many transactions, spreading large batches over several processes.
+        :param transactions: the transactions that should have their signatures validated.
+        :param stop_on_failure: if the verification stops at the first invalid signature.
+        :return: a list telling if each signature is valid. When stopping on failure it ends at the first invalid one.
+        """
+        transactions = list(transactions)
+        results = [True] * len(transactions)
+        # Only the signatures which were not verified before need to be checked.
+        unverified = [position for position, transaction in enumerate(transactions)
+                      if not Wallet.__is_verified(transaction)]
+        if len(unverified) < PARALLEL_VERIFICATION_THRESHOLD:
+            for position in unverified:
+                results[position] = Wallet.__verify_signature(transactions[position])
+                if results[position]:
+                    Wallet.__remember_verified(transactions[position])
+                elif stop_on_failure:
+                    return results[:position + 1]
+            return results
+
+        pool = Wallet.__get_verification_pool()
+        chunks = [unverified[start:start + VERIFICATION_CHUNK_SIZE]
+                  for start in range(0, len(unverified), VERIFICATION_CHUNK_SIZE)]
+        futures = [pool.submit(_verify_chunk, [transactions[position] for position in chunk]) for chunk in chunks]
+        for chunk_number, (chunk, future) in enumerate(zip(chunks, futures)):
+            for position, valid in zip(chunk, future.result()):
+                results[position] = valid
+                if valid:
+                    Wallet.__remember_verified(transactions[position])
+                elif stop_on_failure:
+                    for pending_future in futures[chunk_number + 1:]:
+                        pending_future.cancel()
+                    return results[:position + 1]
+        return results
+
+    @staticmethod
+    def find_invalid_transaction(transactions):
+        """
+        Looks for the first transaction with an invalid signature.
+        :param transactions: the transactions that should have their signatures validated.
+        :return: the index of the first invalid transaction or None if all of them are valid.
+        """
+        results = Wallet.verify_transactions(transactions, stop_on_failure=True)
+        return results.index(False) if False in results else None
+
+    @staticmethod
+    def __get_verification_pool():
+        global _verification_pool
+        if _verification_pool is None:
+            _verification_pool = ProcessPoolExecutor(max_workers=multiprocessing.cpu_count())
+        return _verification_pool
+
+    @staticmethod
+    def cache_stats():
+        """
+        Returns the hit and miss counters of the signature and key caches of this process.
+        :return: a dictionary with the statistics of every cache.
+        """
+        return {
+            'verified_signatures': Wallet._verified_signatures.stats(),
+            'public_keys': Wallet._public_keys.stats(),
+            'private_keys': Wallet._private_keys.stats()
+        }
+
+    @staticmethod
+    def __is_verified(transaction):
         if transaction.sender == 'MINING':
             return True
+        return Wallet._verified_signatures.get(Wallet.__get_cache_key(transaction), False)
 
-        public_key = RSA.importKey(binascii.unhexlify(transaction.sender))
-        verifier = PKCS1_v1_5.new(public_key)
-        h = SHA256.new((str(transaction.sender) + str(transaction.recipient) + str(transaction.amount)).encode('utf8'))
-        return verifier.verify(h, binascii.unhexlify(transaction.signature))
+    @staticmethod
+    def __remember_verified(transaction):
+        Wallet._verified_signatures.put(Wallet.__get_cache_key(transaction), True)
+
+    @staticmethod
+    def __get_cache_key(transaction):
+        # The exact signed message, since equal values such as the amounts 1, 1.0 and True are signed differently.
+        return (transaction.sender, Wallet.__get_message(transaction.sender, transaction.recipient, transaction.amount),
+                transaction.signature)
+
+    @staticmethod
+    def __get_message(sender, recipient, amount):
+        return (str(sender) + str(recipient) + str(amount)).encode('utf8')
+
+    @staticmethod
+    def __verify_signature(transaction):
+        # The scheme is chosen by the tag of the sender key, a signature of another scheme is invalid.
+        try:
+            verifier = Wallet._public_keys.get(transaction.sender)
+            if verifier is None:
+                verifier = signatures.load_verifier(transaction.sender)
+                Wallet._public_keys.put(transaction.sender, verifier)
+            valid = verifier(Wallet.__get_message(transaction.sender, transaction.recipient, transaction.amount),
+                             transaction.signature)
+        except (AttributeError, TypeError, ValueError):
+            valid = False
+        scheme = signatures.get_scheme(transaction.sender) if isinstance(transaction.sender, str) else None
+        metrics.increment('wallet_signature_verifications_total', scheme=scheme or 'unknown',
+                          result='valid' if valid else 'invalid')
+        return valid